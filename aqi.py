@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+# aqi.py
+# GNU General Public License v3.0
+
+# US EPA Air Quality Index from pollutant concentrations.
+# https://en.wikipedia.org/wiki/Air_quality_index#Computing_the_AQI
+# https://www.airnow.gov/sites/default/files/2020-05/aqi-technical-assistance-document-sept2018.pdf
+#
+# The index is meant for averages, e.g. 24 hours for PM2.5 and PM10,
+# not instantaneous readings.
+
+#############################################
+
+from __future__ import print_function
+import math
+from bisect import bisect_right
+from collections import namedtuple
+
+# The breakpoints of one pollutant. Concentrations are truncated to
+# digits decimal places before lookup, after which every value falls
+# in exactly one band: band n runs from lows[n] to highs[n] and maps
+# onto the index range ilows[n] to ihighs[n].
+Breakpoints = namedtuple('Breakpoints', 'pollutant units digits lows highs ilows ihighs')
+
+# The highest index, given for any concentration above the table.
+AQI_MAX = 500
+
+
+def breakpoints(pollutant, units, digits, bands):
+    """
+    Returns Breakpoints built from a list of (low concentration,
+    high concentration, low index, high index) bands in order.
+    """
+    lows, highs, ilows, ihighs = zip(*bands)
+
+    return Breakpoints(pollutant, units, digits, lows, highs, ilows, ihighs)
+
+
+PM25 = breakpoints('PM2.5 24 hour', 'µg/m3', 1,
+                   [(0.0, 12.0, 0, 50),
+                    (12.1, 35.4, 51, 100),
+                    (35.5, 55.4, 101, 150),
+                    (55.5, 150.4, 151, 200),
+                    (150.5, 250.4, 201, 300),
+                    (250.5, 350.4, 301, 400),
+                    (350.5, 500.4, 401, 500)])
+
+PM10 = breakpoints('PM10 24 hour', 'µg/m3', 0,
+                   [(0, 54, 0, 50),
+                    (55, 154, 51, 100),
+                    (155, 254, 101, 150),
+                    (255, 354, 151, 200),
+                    (355, 424, 201, 300),
+                    (425, 504, 301, 400),
+                    (505, 604, 401, 500)])
+
+O3_8H = breakpoints('O3 8 hour', 'ppm', 3,
+                    [(0.000, 0.054, 0, 50),
+                     (0.055, 0.070, 51, 100),
+                     (0.071, 0.085, 101, 150),
+                     (0.086, 0.105, 151, 200),
+                     (0.106, 0.200, 201, 300)])
+
+# Only used from 0.125 ppm, lower 1 hour values have no index.
+O3_1H = breakpoints('O3 1 hour', 'ppm', 3,
+                    [(0.125, 0.164, 101, 150),
+                     (0.165, 0.204, 151, 200),
+                     (0.205, 0.404, 201, 300),
+                     (0.405, 0.504, 301, 400),
+                     (0.505, 0.604, 401, 500)])
+
+CO = breakpoints('CO 8 hour', 'ppm', 1,
+                 [(0.0, 4.4, 0, 50),
+                  (4.5, 9.4, 51, 100),
+                  (9.5, 12.4, 101, 150),
+                  (12.5, 15.4, 151, 200),
+                  (15.5, 30.4, 201, 300),
+                  (30.5, 40.4, 301, 400),
+                  (40.5, 50.4, 401, 500)])
+
+# 1 hour values up to 304 ppb, 24 hour values above.
+SO2 = breakpoints('SO2 1 hour', 'ppb', 0,
+                  [(0, 35, 0, 50),
+                   (36, 75, 51, 100),
+                   (76, 185, 101, 150),
+                   (186, 304, 151, 200),
+                   (305, 604, 201, 300),
+                   (605, 804, 301, 400),
+                   (805, 1004, 401, 500)])
+
+NO2 = breakpoints('NO2 1 hour', 'ppb', 0,
+                  [(0, 53, 0, 50),
+                   (54, 100, 51, 100),
+                   (101, 360, 101, 150),
+                   (361, 649, 151, 200),
+                   (650, 1249, 201, 300),
+                   (1250, 1649, 301, 400),
+                   (1650, 2049, 401, 500)])
+
+# Every table by pollutant
+TABLES = {'pm25': PM25, 'pm10': PM10, 'o3_8h': O3_8H, 'o3_1h': O3_1H,
+          'co': CO, 'so2': SO2, 'no2': NO2}
+
+
+def truncate(c, digits):
+    """
+    Returns c truncated to digits decimal places, as the EPA
+    requires before lookup. c is first rounded well below the
+    last digit so e.g. 0.29 is not truncated to 0.28 for being
+    held as 0.28999...
+    """
+    scale = 10 ** digits
+
+    return math.floor(round(c * scale, 6)) / float(scale)
+
+
+def index(c, table=PM25):
+    """
+    Returns the AQI, a whole number, for the concentration c of
+    the pollutant of table. Concentrations above the table give
+    AQI_MAX, those below it None.
+    """
+    c = truncate(c, table.digits)
+
+    if c > table.highs[-1]:
+        return AQI_MAX
+
+    i = bisect_right(table.lows, c) - 1
+
+    if i < 0:
+        return None
+
+    clow = table.lows[i]
+    ilow = table.ilows[i]
+
+    aqi = float(table.ihighs[i] - ilow) / (table.highs[i] - clow) * (c - clow) + ilow
+
+    # Round half up, not to even.
+    return int(math.floor(aqi + 0.5))
+
+
+def index_array(c, table=PM25):
+    """
+    As index() for a NumPy array (or any sequence) of
+    concentrations, returns a float array with NaN in place of
+    None.
+    """
+    import numpy as np
+
+    scale = 10 ** table.digits
+    c = np.floor(np.round(np.asarray(c, dtype=float) * scale, 6)) / float(scale)
+
+    lows = np.array(table.lows, dtype=float)
+    i = np.searchsorted(lows, c, side='right') - 1
+    j = np.clip(i, 0, len(lows) - 1)
+
+    clow = lows[j]
+    chigh = np.array(table.highs, dtype=float)[j]
+    ilow = np.array(table.ilows, dtype=float)[j]
+    ihigh = np.array(table.ihighs, dtype=float)[j]
+
+    aqi = np.floor((ihigh - ilow) / (chigh - clow) * (c - clow) + ilow + 0.5)
+
+    aqi = np.where(c > table.highs[-1], float(AQI_MAX), aqi)
+
+    return np.where(i < 0, np.nan, aqi)
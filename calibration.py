@@ -0,0 +1,283 @@
+#!/usr/bin/env python
+
+# calibration.py
+# GNU General Public License v3.0
+
+# Per device calibration of the PPD42NS low pulse ratio to concentration
+# curve, fitted by least squares against a co-located reference.
+#
+# $ python3 calibration.py airqualitylog.csv reference.csv --device gpio18
+# fits a cubic to the PM2.5 ratios of the log and the reference readings
+# and stores it in calibration.json, which pidustsensor.py loads with
+# --calibration calibration.json.
+#
+# The reference csv has a header line, then a time stamp and a reading
+# per line, each reading the average in µg/m3 from that time stamp for
+# --period seconds, e.g. PM2.5 for gpio18 and PM10 for gpio17. The fitted
+# curve gives µg/m3, which pidustsensor.py and reprocess.py log in place
+# of the µg/m3 worked out from the counts with a particle size profile;
+# the counts themselves still come from the data sheet curve.
+
+#############################################
+
+from __future__ import print_function
+import json
+import os
+
+import csvlog
+
+# Rows of the log read at a time while fitting
+CHUNK_ROWS = 262144
+
+# Ratios are fitted scaled down by this to keep the normal equations
+# well conditioned.
+SCALE = 100.0
+
+
+class Calibration:
+    """
+    A ratio to concentration curve, a polynomial of degree degree
+    in the ratio, plus for each knot a term in (ratio - knot)**degree
+    for ratios above it. Without knots this is a plain polynomial,
+    with them a piecewise polynomial (a spline) whose pieces join
+    smoothly at the knots.
+
+    coefficients are those of 1, ratio, ratio**2 ... ratio**degree
+    followed by those of the knot terms in order.
+    """
+
+    def __init__(self, coefficients, degree=3, knots=()):
+        if len(coefficients) != degree + 1 + len(knots):
+            raise ValueError('{} coefficients do not fit degree {} with {} knots'.format(
+                len(coefficients), degree, len(knots)))
+
+        self.coefficients = tuple(float(c) for c in coefficients)
+        self.degree = degree
+        self.knots = tuple(float(k) for k in knots)
+
+    def __call__(self, ratio):
+        """
+        Returns the concentration for a percentage low pulse time.
+        """
+        degree = self.degree
+        coefficients = self.coefficients
+
+        conc = 0.0
+        for c in reversed(coefficients[:degree + 1]):
+            conc = conc * ratio + c
+
+        for knot, c in zip(self.knots, coefficients[degree + 1:]):
+            if ratio > knot:
+                conc = conc + c * (ratio - knot) ** degree
+
+        return conc
+
+    def array(self, ratios):
+        """
+        As calling the calibration for a NumPy array (or any
+        sequence) of ratios.
+        """
+        import numpy as np
+
+        ratios = np.asarray(ratios, dtype=float)
+
+        return _basis(np, ratios, self.degree, self.knots).dot(np.array(self.coefficients))
+
+    def to_dict(self):
+        return {'degree': self.degree, 'knots': list(self.knots),
+                'coefficients': list(self.coefficients)}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d['coefficients'], d.get('degree', 3), d.get('knots', ()))
+
+    def __repr__(self):
+        return 'Calibration({!r}, {!r}, {!r})'.format(self.coefficients, self.degree, self.knots)
+
+
+# The curve of the PPD42NS data sheet, used without a calibration.
+DEFAULT = Calibration([0.62, 520, -3.8, 1.1], 3)
+
+
+def _basis(np, x, degree, knots):
+    """
+    Returns the design matrix of x, one row per value and one
+    column per coefficient.
+    """
+    columns = [x ** n for n in range(degree + 1)]
+    columns.extend(np.maximum(x - knot, 0.0) ** degree for knot in knots)
+
+    return np.column_stack(columns)
+
+
+class Fit:
+    """
+    Least squares fit of a Calibration built up from any number
+    of chunks of (ratio, reference) pairs. Only the normal
+    equations are kept, so memory use does not grow with the
+    data and each chunk is handled in a few NumPy operations.
+    """
+
+    def __init__(self, degree=3, knots=()):
+        import numpy as np
+
+        self._np = np
+        self.degree = degree
+        self.knots = tuple(knots)
+        self.count = 0
+
+        size = degree + 1 + len(self.knots)
+        self._xtx = np.zeros((size, size))
+        self._xty = np.zeros(size)
+
+    def add(self, ratios, references):
+        """
+        Adds arrays of ratios and the matching reference readings.
+        """
+        np = self._np
+
+        # Fit in ratio / SCALE, see solve().
+        x = _basis(np, np.asarray(ratios, dtype=float) / SCALE, self.degree,
+                   [knot / SCALE for knot in self.knots])
+        y = np.asarray(references, dtype=float)
+
+        self._xtx += x.T.dot(x)
+        self._xty += x.T.dot(y)
+        self.count = self.count + len(y)
+
+    def solve(self):
+        """
+        Returns the Calibration best fitting the data added.
+        """
+        np = self._np
+
+        if self.count == 0:
+            raise ValueError('nothing to fit')
+
+        scaled = np.linalg.lstsq(self._xtx, self._xty, rcond=None)[0]
+
+        # Undo the scaling, the power n terms were fitted in
+        # (ratio / SCALE)**n and each knot term in degree powers.
+        degree = self.degree
+        powers = list(range(degree + 1)) + [degree] * len(self.knots)
+        coefficients = [c / SCALE ** n for c, n in zip(scaled, powers)]
+
+        return Calibration(coefficients, degree, self.knots)
+
+
+def read_reference(filename):
+    """
+    Returns arrays of the start times and readings of a reference
+    csv, in time order.
+    """
+    import numpy as np
+
+    data = np.loadtxt(filename, delimiter=',', skiprows=1, usecols=(0, 1), ndmin=1,
+                      dtype=[('time', 'datetime64[us]'), ('value', 'f8')])
+    data.sort(order='time')
+
+    return data['time'], data['value']
+
+
+def fit_log(log, reference, period=3600, column=1, degree=3, knots=(), chunk=CHUNK_ROWS):
+    """
+    Fits a Calibration to the ratios in column of the csv log
+    against the reference csv, see read_reference(). Each logged
+    ratio is paired with the reference reading whose period it
+    falls in, ratios of 100% (sensor errors) and those with no
+    reference reading are left out, as are damaged rows, e.g. cut
+    short by a power cut, see csvlog.read_chunks(). The log is
+    streamed chunk rows at a time.
+
+    Returns the Calibration, the number of readings fitted and the
+    number of malformed rows left out.
+    """
+    import numpy as np
+
+    times, values = read_reference(reference)
+    ends = times + np.timedelta64(int(period * 1000000), 'us')
+
+    fit = Fit(degree, knots)
+    skipped = 0
+
+    with open(log, newline='') as f:
+        header = next(f, '')
+
+        def parse(lines):
+            return np.loadtxt(lines, delimiter=',', usecols=(0, column), ndmin=1,
+                              dtype=[('time', 'datetime64[us]'), ('ratio', 'f8')])
+
+        for lines, data, left_out in csvlog.read_chunks(f, header, parse, chunk):
+            skipped = skipped + left_out
+            if not lines:
+                continue
+
+            # The reference period each reading falls in
+            i = np.searchsorted(times, data['time'], side='right') - 1
+            j = np.clip(i, 0, len(times) - 1)
+
+            keep = (i >= 0) & (data['time'] < ends[j]) & (data['ratio'] < 100) & np.isfinite(values[j])
+
+            fit.add(data['ratio'][keep], values[j][keep])
+
+    return fit.solve(), fit.count, skipped
+
+
+def load(filename):
+    """
+    Returns a dict of the Calibrations in filename by device name.
+    """
+    with open(filename) as f:
+        profiles = json.load(f)
+
+    return dict((name, Calibration.from_dict(d)) for name, d in profiles.items())
+
+
+def save(filename, name, calibration):
+    """
+    Stores calibration for the device name in filename, keeping
+    those of other devices.
+    """
+    profiles = {}
+    if os.path.exists(filename):
+        with open(filename) as f:
+            profiles = json.load(f)
+
+    profiles[name] = calibration.to_dict()
+
+    temp = filename + '.tmp'
+    with open(temp, 'w') as f:
+        json.dump(profiles, f, indent=2, sort_keys=True)
+
+    os.replace(temp, filename)
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Fit a PPD42NS calibration against reference readings.')
+    parser.add_argument('log', help='csv log of the sensor, e.g. airqualitylog.csv')
+    parser.add_argument('reference', help='csv of reference readings')
+    parser.add_argument('--device', default='gpio18',
+                        help='name to store the calibration under (default %(default)s)')
+    parser.add_argument('--column', type=int, default=1,
+                        help='column of the ratio in the log, 1 for PM2.5 and 3 for PM1.0 (default %(default)s)')
+    parser.add_argument('--period', type=float, default=3600,
+                        help='seconds each reference reading covers (default %(default)s)')
+    parser.add_argument('--degree', type=int, default=3,
+                        help='degree of the polynomial (default %(default)s)')
+    parser.add_argument('--knots', type=float, nargs='*', default=[], metavar='RATIO',
+                        help='ratios at which to start a new piece of the curve')
+    parser.add_argument('--output', default='calibration.json',
+                        help='file of calibrations to store it in (default %(default)s)')
+    args = parser.parse_args()
+
+    calibration, count, skipped = fit_log(args.log, args.reference, args.period, args.column,
+                                          args.degree, args.knots)
+
+    save(args.output, args.device, calibration)
+
+    print("Fitted {} to {} readings, stored as {} in {}".format(calibration, count, args.device, args.output))
+    if skipped:
+        print("Left out {} malformed rows".format(skipped))
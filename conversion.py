@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+# conversion.py
+# GNU General Public License v3.0
+
+# Conversions from PPD42NS low pulse ratios to particle counts, µg/m3
+# and US AQI, one reading at a time for the live loops or, with NumPy,
+# whole arrays of readings at once for reprocessing old logs.
+
+#############################################
+
+from __future__ import print_function
+import math
+from collections import namedtuple
+
+import aqi
+
+# Particles per 0.01 cubic foot to particles per cubic metre
+PER_CUBIC_METRE = 3531.5
+
+# The concentration the calibration curve gives for a ratio of 100%,
+# which the sensor only reads when it is faulty or disconnected.
+ERROR_CONCENTRATION = 1114000.62
+
+# Particle size assumptions used to turn counts into µg/m3, with the
+# µg/m3 per particle / 0.01 cubic foot of each channel precomputed.
+Profile = namedtuple('Profile', 'name density radius25 radius10 ugm3_pm25 ugm3_pm10')
+
+# What convert() returns, one array per value of the airquality() row.
+Conversion = namedtuple('Conversion', 'c25 c10 pm25count pm10count ugm3_pm25 ugm3_pm10 '
+                                      'aqi_pm25 aqi_pm10')
+
+def profile(name, density, radius25, radius10):
+    """
+    Returns a Profile for particles of density µg/m3 and the
+    given radius in metres in the PM2.5 and PM10 channels.
+
+    This is the method outlined by Drexel University students
+    (2009). It assumes all particles are spheres and does not
+    correct for humidity or rain.
+    """
+    def factor(radius):
+        # mass = density * volume of a sphere, µg/m3 = parts/m3 * mass
+        return PER_CUBIC_METRE * density * 4.0 / 3.0 * math.pi * radius ** 3
+
+    return Profile(name, density, radius25, radius10, factor(radius25), factor(radius10))
+
+
+# Known particle size assumptions by name
+PROFILES = {
+    # 0.44 µm particles in both channels, as pidustsensor.py has always logged
+    'drexel': profile('drexel', 1.65e12, 0.44e-6, 0.44e-6),
+
+    # 2.6 µm particles in the PM10 channel, as in the Drexel paper
+    'drexel-coarse': profile('drexel-coarse', 1.65e12, 0.44e-6, 2.6e-6),
+}
+
+DEFAULT_PROFILE = PROFILES['drexel']
+
+
+def _profile(p):
+    """
+    Returns the Profile p or the one named p.
+    """
+    if isinstance(p, Profile):
+        return p
+
+    try:
+        return PROFILES[p]
+    except KeyError:
+        raise ValueError('unknown conversion profile {!r}'.format(p))
+
+
+def concentration(ratio):
+    """
+    Returns the calibrated concentration in particles per 0.01
+    cubic foot for a percentage low pulse time.
+    """
+    return 1.1*pow(ratio,3)-3.8*pow(ratio,2)+520*ratio+0.62
+
+
+def counts(c25):
+    """
+    Returns the (PM25count, PM10count) particles per 0.01 cubic
+    foot for a PM2.5 channel concentration, error readings and
+    negative values counted as 0.
+
+    Both are the PM2.5 channel (particles over 2.5 µm), the PM1.0
+    channel is not subtracted from it as its readings are not
+    reliable enough.
+    """
+    if c25 == ERROR_CONCENTRATION or c25 < 0:
+        return (0, 0)
+
+    return (c25, c25)
+
+
+def ugm3(pm25count, pm10count, p=DEFAULT_PROFILE):
+    """
+    Returns the (PM2.5, PM10) µg/m3 for the given counts in
+    particles per 0.01 cubic foot.
+    """
+    p = _profile(p)
+
+    return (pm25count * p.ugm3_pm25, pm10count * p.ugm3_pm10)
+
+
+def calibrated(ratio, calibration):
+    """
+    Returns the µg/m3 calibration, a calibration.Calibration
+    fitted against a reference in µg/m3, gives for a percentage
+    low pulse time, error readings (a ratio of 100%) and negative
+    values counted as 0.
+    """
+    if ratio >= 100.0:
+        return 0.0
+
+    return max(calibration(ratio), 0.0)
+
+
+def reading_ugm3(r25, c25, r10, p=DEFAULT_PROFILE, calibration25=None, calibration10=None):
+    """
+    Returns the (PM2.5, PM10) µg/m3 of a reading, the PM2.5
+    ratio r25 and concentration c25 and the PM1.0 ratio r10.
+
+    The µg/m3 of a channel with a calibration comes straight from
+    its ratio, see calibrated(), otherwise from the counts with
+    the particle sizes of the profile p, see ugm3().
+    """
+    ugm3_pm25, ugm3_pm10 = ugm3(*counts(c25), p=p)
+
+    if calibration25 is not None:
+        ugm3_pm25 = calibrated(r25, calibration25)
+
+    if calibration10 is not None:
+        ugm3_pm10 = calibrated(r10, calibration10)
+
+    return (ugm3_pm25, ugm3_pm10)
+
+
+def convert(r25, r10, p=DEFAULT_PROFILE, calibration25=None, calibration10=None, dry=None):
+    """
+    Converts arrays (or any sequences) of PM2.5 and PM1.0 channel
+    ratios to a Conversion of NumPy arrays in one go, using the
+    profile p, a Profile or the name of one in PROFILES. The µg/m3
+    of a channel with a calibration.Calibration comes from it as in
+    reading_ugm3(). dry, the fraction of each reading left once
+    corrected for humidity (see humidity.correct_array()), scales
+    the concentrations of all but error readings.
+
+    Values are as logged by airquality() but counts and µg/m3
+    are not truncated to whole numbers.
+    """
+    import numpy as np
+
+    p = _profile(p)
+
+    r25 = np.asarray(r25, dtype=float)
+    r10 = np.asarray(r10, dtype=float)
+
+    # As concentration(), so error readings compare equal.
+    c25 = 1.1 * r25 ** 3 - 3.8 * r25 ** 2 + 520 * r25 + 0.62
+    c10 = 1.1 * r10 ** 3 - 3.8 * r10 ** 2 + 520 * r10 + 0.62
+
+    if dry is not None:
+        c25 = np.where(c25 == ERROR_CONCENTRATION, c25, c25 * dry)
+        c10 = np.where(c10 == ERROR_CONCENTRATION, c10, c10 * dry)
+
+    count = np.where((c25 == ERROR_CONCENTRATION) | (c25 < 0), 0.0, c25)
+
+    ugm3_pm25 = count * p.ugm3_pm25
+    ugm3_pm10 = count * p.ugm3_pm10
+
+    # As calibrated()
+    if calibration25 is not None:
+        ugm3_pm25 = np.where(r25 >= 100.0, 0.0, np.maximum(calibration25.array(r25), 0.0))
+
+    if calibration10 is not None:
+        ugm3_pm10 = np.where(r10 >= 100.0, 0.0, np.maximum(calibration10.array(r10), 0.0))
+
+    return Conversion(c25, c10, count, count, ugm3_pm25, ugm3_pm10,
+                      aqi.index_array(ugm3_pm25, aqi.PM25), aqi.index_array(ugm3_pm10, aqi.PM10))
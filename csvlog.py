@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+
+# csvlog.py
+# GNU General Public License v3.0
+
+# Append only csv log of the sensor readings, rotated by size and or
+# time, with a fixed flush and fsync cadence.
+#
+# Restarting the logger carries on at the end of the log, and rotated
+# logs are renamed with the time they were closed, e.g.
+# airqualitylog-20190601-000000.csv, and optionally gzipped.
+#
+# read_chunks() reads such a log back in chunks for the bulk tools,
+# leaving out the rows a power cut or a full card left damaged.
+
+#############################################
+
+from __future__ import print_function
+import gzip
+import io
+import itertools
+import os
+import shutil
+import threading
+import time
+from csv import writer
+from datetime import datetime
+
+# Header of the air quality csv log, one column per value in the
+# rows returned by pidustsensor.airquality()
+AIRQUALITY_HEADER = ['Date Time Stamp',
+                     'Ratio for PM2.5 (P2 or Pin4) (r25)',
+                     'Raw Readings of PM2.5 Concentration (PCS per 0.01 cubic foot) (c25)',
+                     'Ratio for PM1.0 (P1 or Pin2) (r10)',
+                     'Raw readings of PM1.0 Concentration (PCS  per 0.01 cubic foot) (c10)',
+                     'Concentration Count for Particles Greater than 1µg and Less than 2.5µ (PCS per 0.01 cubic foot) (PM25count = c10 - c25)',
+                     'SI PM2.5 Concentration (PCS per cubic metre) (concentration_ugm3_pm25)',
+                     'Concentration Count for Particles greater than 2.5 µg (PCS per 0.01 cubic foot) (PM10count = c25)',
+                     'SI PM10 Concentration (PCS per cubic metre)(concentration_ugm3_pm10)',
+                     'US AQI for PM2.5 (Should be average of a 24h reading)',
+                     'US AQI for PM10 (Should be average of a 24h reading)']
+
+# Header of the environment csv log written with the BME680, see
+# pidustbme680.py and pidustdaemon.py --bme680
+ENVIRONMENT_HEADER = ['Date Time Stamp',
+                      'Ratio for PM2.5 (P2 or Pin4) (r25)',
+                      'Humidity Corrected PM2.5 Concentration (PCS per 0.01 cubic foot) (c25)',
+                      'Ratio for PM1.0 (P1 or Pin2) (r10)',
+                      'Humidity Corrected PM1.0 Concentration (PCS per 0.01 cubic foot) (c10)',
+                      'Temperature (C)',
+                      'Pressure (hPa)',
+                      'Humidity (%RH)',
+                      'Gas Resistance (Ohms)']
+
+# Default cadence, rows are handed to the OS every FLUSH_ROWS rows and
+# forced onto the card at most every FSYNC_SECONDS.
+FLUSH_ROWS = 1
+FSYNC_SECONDS = 60
+
+
+class CSVLog:
+    """
+    Writes rows to the csv log path, appending to it if it exists
+    and only writing header to a new log.
+
+    The log is rotated once it reaches max_bytes and or when a new
+    period of rotate_seconds starts, periods starting at multiples
+    of rotate_seconds from the epoch, e.g. 86400 for UTC days. With
+    compress the rotated log is gzipped on a thread of its own.
+
+    Rows are flushed to the OS every flush_rows rows, so they
+    survive the logger being killed, and synced to the card at most
+    every fsync_seconds (0 on every flush), which bounds what a
+    power cut can lose. close() flushes and syncs what is left.
+    """
+
+    def __init__(self, path, header, max_bytes=None, rotate_seconds=None, compress=False,
+                 flush_rows=FLUSH_ROWS, fsync_seconds=FSYNC_SECONDS, clock=time.time):
+        self.path = path
+        self.header = header
+        self.max_bytes = max_bytes
+        self.rotate_seconds = rotate_seconds
+        self.compress = compress
+        self.flush_rows = flush_rows
+        self.fsync_seconds = fsync_seconds
+
+        self._clock = clock
+        self._compressing = []
+
+        self._open()
+
+    def _open(self):
+        """
+        Opens the log for appending, rotating it first if it is from
+        an earlier period or has another header, so every log holds
+        rows of one layout.
+        """
+        if os.path.exists(self.path):
+            if self.rotate_seconds and self._period(os.path.getmtime(self.path)) != self._period(self._clock()):
+                self._rename()
+
+            else:
+                with open(self.path, newline='') as f:
+                    header = f.readline()
+
+                if header and header != self._header_line():
+                    self._rename()
+
+        self._file = open(self.path, 'a', newline='')
+        self._writer = writer(self._file)
+
+        self._unflushed = 0
+        self._synced = self._clock()
+        self._started = self._period(self._synced)
+
+        if self._file.tell() == 0:
+            self._writer.writerow(self.header)
+
+        else:
+            # A power cut can leave the last row cut short, start
+            # the next on a line of its own.
+            with open(self.path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    self._file.write('\n')
+
+    def _header_line(self):
+        line = io.StringIO()
+        writer(line).writerow(self.header)
+        return line.getvalue()
+
+    def _period(self, t):
+        return int(t // self.rotate_seconds) if self.rotate_seconds else None
+
+    def write(self, row):
+        """
+        Appends row, flushing, syncing and rotating as due.
+        """
+        if self.rotate_seconds and self._period(self._clock()) != self._started:
+            self.rotate()
+
+        self._writer.writerow(row)
+        self._unflushed += 1
+
+        if self._unflushed >= self.flush_rows:
+            self.flush()
+
+        if self.max_bytes and self._file.tell() >= self.max_bytes:
+            self.rotate()
+
+    def flush(self, sync=False):
+        """
+        Hands the buffered rows to the OS, and syncs them to the card
+        if sync is set or fsync_seconds have passed since the last.
+        """
+        self._file.flush()
+        self._unflushed = 0
+
+        now = self._clock()
+        if sync or now - self._synced >= self.fsync_seconds:
+            os.fsync(self._file.fileno())
+            self._synced = now
+
+    def rotate(self):
+        """
+        Closes the log, renames it and starts a new one.
+        """
+        self._close_file()
+        self._rename()
+        self._open()
+
+    def _close_file(self):
+        self.flush(sync=True)
+        self._file.close()
+
+    def _rename(self):
+        """
+        Moves the log aside under the time now, gzipping it in the
+        background with compress.
+        """
+        stem, ext = os.path.splitext(self.path)
+        name = '{}-{}'.format(stem, datetime.fromtimestamp(self._clock()).strftime('%Y%m%d-%H%M%S'))
+
+        rotated = name + ext
+        n = 1
+        while os.path.exists(rotated) or os.path.exists(rotated + '.gz'):
+            rotated = '{}-{}{}'.format(name, n, ext)
+            n = n + 1
+
+        os.rename(self.path, rotated)
+
+        if self.compress:
+            thread = threading.Thread(target=gzip_file, args=(rotated,))
+            thread.daemon = True
+            thread.start()
+            self._compressing = [t for t in self._compressing if t.is_alive()] + [thread]
+
+    def close(self):
+        """
+        Flushes and syncs the log and closes it, waiting for any
+        rotated log still being gzipped.
+        """
+        self._close_file()
+
+        for thread in self._compressing:
+            thread.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def gzip_file(path):
+    """
+    Replaces path by path.gz. The gzip is written aside and moved
+    into place before path is removed, so one of them is always
+    complete.
+    """
+    temp = path + '.gz.tmp'
+
+    with open(path, 'rb') as f, gzip.open(temp, 'wb') as out:
+        shutil.copyfileobj(f, out)
+
+    os.replace(temp, path + '.gz')
+    os.remove(path)
+
+
+def read_chunks(f, header, parse, chunk):
+    """
+    Reads the csv log f, positioned after its header line, chunk
+    rows at a time. Yields for each chunk the lines kept, what
+    parse() returns for them (None if none are kept) and the
+    number of rows left out.
+
+    Rows without as many fields as header, e.g. cut short by a
+    power cut, are left out, as are rows parse() raises a
+    ValueError on, e.g. one cut off after a comma. Those are only
+    looked for when the whole chunk fails to parse, each row then
+    being parsed on its own.
+    """
+    commas = header.count(',')
+
+    while True:
+        lines = list(itertools.islice(f, chunk))
+        if not lines:
+            return
+
+        kept = [line for line in lines if line.count(',') == commas]
+
+        try:
+            data = parse(kept) if kept else None
+
+        except ValueError:
+            kept = [line for line in kept if _parses(parse, line)]
+            data = parse(kept) if kept else None
+
+        yield kept, data, len(lines) - len(kept)
+
+
+def _parses(parse, line):
+    try:
+        parse([line])
+    except ValueError:
+        return False
+    return True
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+
+# humidity.py
+# GNU General Public License v3.0
+
+# Humidity correction of the PPD42NS concentrations.
+#
+# Particles take up water and grow in humid air, so an optical sensor
+# counts more and bigger particles than are there when dry. Following
+# k-Köhler theory, as applied to low cost optical sensors by Crilley et
+# al. (2018) https://doi.org/10.5194/amt-11-709-2018, the reading is
+# divided by the growth
+#
+#     C dry = C / (1 + (kappa / density) / (100 / RH - 1))
+#
+# where kappa is the hygroscopicity of the particles and density their
+# dry density in g/cm3.
+#
+# pidustbme680.py and pidustdaemon.py --bme680 log and upload the
+# corrected c25 and c10. For logs written before they did
+# $ python3 humidity.py envirosensorlog.csv corrected.csv
+# appends the corrected c25 and c10 to every row.
+
+#############################################
+
+from __future__ import print_function
+
+import csvlog
+
+# Hygroscopicity and dry density (g/cm3) of typical urban aerosol,
+# the values fitted by Crilley et al.
+KAPPA = 0.62
+DENSITY = 1.65
+
+# Humidity in %RH the correction is capped at, the growth heads to
+# infinity as the air nears saturation and the sensor is unreliable
+# in fog anyway.
+MAX_HUMIDITY = 95.0
+
+# Highest ceiling taken, at 100 %RH the growth is infinite.
+CEILING_LIMIT = 99.9
+
+# Rows converted at a time by correct_log()
+CHUNK_ROWS = 65536
+
+# Columns of c25, c10 and humidity in the BME680 log, see
+# csvlog.ENVIRONMENT_HEADER.
+LOG_COLUMNS = (2, 4, 7)
+
+
+def growth(humidity, kappa=KAPPA, density=DENSITY, ceiling=MAX_HUMIDITY):
+    """
+    Returns the factor particles have grown by at humidity %RH,
+    1 for dry air. ceiling is taken as at most CEILING_LIMIT.
+    """
+    humidity = min(max(humidity, 0.0), ceiling, CEILING_LIMIT)
+
+    if humidity == 0.0:
+        return 1.0
+
+    return 1.0 + (kappa / density) / (100.0 / humidity - 1.0)
+
+
+def correct(conc, humidity, kappa=KAPPA, density=DENSITY, ceiling=MAX_HUMIDITY):
+    """
+    Returns the concentration conc read at humidity %RH
+    corrected to dry air.
+    """
+    return conc / growth(humidity, kappa, density, ceiling)
+
+
+def correct_array(conc, humidity, kappa=KAPPA, density=DENSITY, ceiling=MAX_HUMIDITY):
+    """
+    As correct() for NumPy arrays (or any sequences) of
+    concentrations and humidities, in one pass.
+    """
+    import numpy as np
+
+    humidity = np.clip(np.asarray(humidity, dtype=float), 0.0, min(ceiling, CEILING_LIMIT))
+
+    with np.errstate(divide='ignore'):
+        grown = 1.0 + (kappa / density) / (100.0 / humidity - 1.0)
+
+    # At 0 %RH 100/RH is infinite and the growth exactly 1.
+    return np.asarray(conc, dtype=float) / grown
+
+
+def correct_log(source, target, kappa=KAPPA, density=DENSITY, ceiling=MAX_HUMIDITY,
+                columns=LOG_COLUMNS, chunk=CHUNK_ROWS):
+    """
+    Copies the csv log source to target adding the corrected c25
+    and c10 to every row, columns giving the index of c25, c10 and
+    humidity. The log is read and corrected chunk rows at a time
+    so it may be any size. Damaged rows, e.g. cut short by a
+    power cut, are left out, see csvlog.read_chunks().
+
+    Returns the number of rows corrected and the number left out.
+    """
+    import numpy as np
+
+    rows = 0
+    skipped = 0
+
+    with open(source, newline='') as f, open(target, 'w', newline='') as out:
+
+        header = next(f, None)
+        if header is None:
+            return 0, 0
+
+        out.write(header.rstrip('\r\n') + ',Dry c25,Dry c10\n')
+
+        # c25, c10 and humidity of every row
+        def parse(lines):
+            return np.loadtxt(lines, delimiter=',', usecols=columns, ndmin=2)
+
+        for lines, values, left_out in csvlog.read_chunks(f, header, parse, chunk):
+            skipped = skipped + left_out
+            if not lines:
+                continue
+
+            c25 = correct_array(values[:, 0], values[:, 2], kappa, density, ceiling)
+            c10 = correct_array(values[:, 1], values[:, 2], kappa, density, ceiling)
+
+            out.writelines('{},{:d},{:d}\n'.format(line.rstrip('\r\n'), a, b)
+                           for line, a, b in zip(lines, c25.astype(int).tolist(), c10.astype(int).tolist()))
+
+            rows = rows + len(lines)
+
+    return rows, skipped
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Add humidity corrected concentrations to a BME680 log.')
+    parser.add_argument('source', help='csv log written with the BME680')
+    parser.add_argument('target', help='csv file to write')
+    parser.add_argument('--kappa', type=float, default=KAPPA,
+                        help='particle hygroscopicity (default %(default)s)')
+    parser.add_argument('--density', type=float, default=DENSITY,
+                        help='dry particle density in g/cm3 (default %(default)s)')
+    parser.add_argument('--max-humidity', type=float, default=MAX_HUMIDITY,
+                        help='cap the correction at this %%RH (default %(default)s)')
+    args = parser.parse_args()
+
+    rows, skipped = correct_log(args.source, args.target, args.kappa, args.density, args.max_humidity)
+
+    print("Corrected {} rows, left out {} malformed rows".format(rows, skipped))
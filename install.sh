@@ -51,6 +51,13 @@ mkdir pidustsensor
 # Copy script from Github
 cd ~/pidustsensor
 wget --no-check-certificate https://raw.githubusercontent.com/mauricecyril/pidustsensor/master/pidustsensor.py
+wget --no-check-certificate https://raw.githubusercontent.com/mauricecyril/pidustsensor/master/conversion.py
+wget --no-check-certificate https://raw.githubusercontent.com/mauricecyril/pidustsensor/master/aqi.py
+wget --no-check-certificate https://raw.githubusercontent.com/mauricecyril/pidustsensor/master/nowcast.py
+wget --no-check-certificate https://raw.githubusercontent.com/mauricecyril/pidustsensor/master/rollingstats.py
+wget --no-check-certificate https://raw.githubusercontent.com/mauricecyril/pidustsensor/master/calibration.py
+wget --no-check-certificate https://raw.githubusercontent.com/mauricecyril/pidustsensor/master/scheduler.py
+wget --no-check-certificate https://raw.githubusercontent.com/mauricecyril/pidustsensor/master/csvlog.py
 
 # Install startup jobs
 echo "-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_-_"
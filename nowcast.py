@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+# nowcast.py
+# GNU General Public License v3.0
+
+# EPA NowCast and 24 hour average of a particulate concentration, kept
+# up to date a sample at a time.
+# https://usepa.servicenowservices.com/airnow/en/kb_article_view?sys_kb_id=fed0037b1b62545040a1a7dbe54bcbd4
+
+#############################################
+
+from __future__ import print_function
+import json
+import os
+from array import array
+
+import aqi
+
+# Complete hours of data kept, enough for the 24 hour average.
+HOURS = 24
+
+# Slots in the ring, the complete hours and the one being filled.
+SLOTS = HOURS + 1
+
+# Hours the NowCast is weighted over.
+NOWCAST_HOURS = 12
+
+# Hours of the last 24 which must have data for a 24 hour average,
+# as for the EPA's 75% completeness rule.
+MEAN_HOURS = 18
+
+
+class NowCast:
+    """
+    Keeps the hourly averages of one pollutant's concentration for
+    the last day in a ring indexed by hour number, with a running
+    total over the ring, so adding a sample only ever touches the
+    current hour.
+
+    The NowCast and 24 hour average only count complete hours and
+    are worked out when an hour completes, so reading them costs
+    nothing. With a path the hourly averages are saved there every
+    hour and reloaded on start, so a restart keeps the history.
+    """
+
+    def __init__(self, table=aqi.PM25, path=None):
+        """
+        Instantiate with the aqi breakpoint table of the pollutant
+        and optionally the file to keep the state in.
+        """
+        self.table = table
+        self.path = path
+
+        # Sum and number of samples of each hour, by hour % SLOTS.
+        self._sums = array('d', [0.0]) * SLOTS
+        self._counts = array('L', [0]) * SLOTS
+
+        # The hour being filled, as hours since the epoch.
+        self._hour = None
+
+        # Totals of the complete hours in the ring.
+        self._total = 0.0
+        self._hours = 0
+
+        self._nowcast = None
+
+        if path is not None and os.path.exists(path):
+            self._load()
+
+    def add(self, timestamp, value):
+        """
+        Adds a concentration sampled at timestamp, in seconds since
+        the epoch. Samples must come in time order.
+        """
+        hour = int(timestamp // 3600)
+
+        if self._hour is None:
+            self._hour = hour
+
+        elif hour > self._hour:
+            self._roll(hour)
+            if self.path is not None:
+                self.save()
+
+        elif hour < self._hour:
+            return # Older than the hour being filled.
+
+        i = hour % SLOTS
+        self._sums[i] += value
+        self._counts[i] += 1
+
+    def _roll(self, hour):
+        """
+        Completes the hour being filled and moves on to hour,
+        dropping hours that fall out of the ring.
+        """
+        sums = self._sums
+        counts = self._counts
+
+        if hour - self._hour >= SLOTS:
+            # Nothing kept is recent enough, start afresh.
+            for i in range(SLOTS):
+                sums[i] = 0.0
+                counts[i] = 0
+            self._total = 0.0
+            self._hours = 0
+
+        else:
+            # The hour just completed joins the totals.
+            i = self._hour % SLOTS
+            if counts[i]:
+                self._total = self._total + sums[i] / counts[i]
+                self._hours = self._hours + 1
+
+            # Clear the slots of the new hour and any skipped, each
+            # held a complete hour now more than HOURS old.
+            for h in range(self._hour + 1, hour + 1):
+                i = h % SLOTS
+                if counts[i]:
+                    self._total = self._total - sums[i] / counts[i]
+                    self._hours = self._hours - 1
+                sums[i] = 0.0
+                counts[i] = 0
+
+        self._hour = hour
+        self._nowcast = self._weigh()
+
+    def _weigh(self):
+        """
+        Returns the NowCast of the complete hours, or None without
+        data for at least two of the last three.
+        """
+        averages = []
+        for h in range(self._hour - 1, self._hour - 1 - NOWCAST_HOURS, -1):
+            i = h % SLOTS
+            averages.append(self._sums[i] / self._counts[i] if self._counts[i] else None)
+
+        if sum(1 for c in averages[:3] if c is not None) < 2:
+            return None
+
+        present = [c for c in averages if c is not None]
+        highest = max(present)
+
+        weight = min(present) / highest if highest > 0 else 1.0
+        weight = max(weight, 0.5)
+
+        total = 0.0
+        weights = 0.0
+        factor = 1.0
+
+        for c in averages:
+            if c is not None:
+                total = total + factor * c
+                weights = weights + factor
+            factor = factor * weight
+
+        return total / weights
+
+    def nowcast(self):
+        """
+        Returns the NowCast concentration, or None.
+        """
+        return self._nowcast
+
+    def mean(self):
+        """
+        Returns the average of the hourly averages of the last 24
+        complete hours, or None with fewer than MEAN_HOURS of them.
+        """
+        if self._hours < MEAN_HOURS:
+            return None
+
+        return self._total / self._hours
+
+    def aqi(self):
+        """
+        Returns the AQI of the NowCast, or None.
+        """
+        c = self._nowcast
+        return None if c is None else aqi.index(c, self.table)
+
+    def aqi24(self):
+        """
+        Returns the AQI of the 24 hour average, or None.
+        """
+        c = self.mean()
+        return None if c is None else aqi.index(c, self.table)
+
+    def save(self):
+        """
+        Writes the state to path, replacing the old file in one
+        step so a crash never leaves it half written.
+        """
+        state = {'hour': self._hour,
+                 'sums': list(self._sums),
+                 'counts': list(self._counts)}
+
+        temp = self.path + '.tmp'
+        with open(temp, 'w') as f:
+            json.dump(state, f)
+
+        os.replace(temp, self.path)
+
+    def _load(self):
+        """
+        Reads the state saved in path.
+        """
+        with open(self.path) as f:
+            state = json.load(f)
+
+        if len(state['sums']) != SLOTS:
+            raise ValueError('{} does not hold {} hours'.format(self.path, SLOTS))
+
+        self._sums = array('d', state['sums'])
+        self._counts = array('L', state['counts'])
+        self._hour = state['hour']
+
+        # Rebuild the totals of the complete hours.
+        self._total = 0.0
+        self._hours = 0
+
+        for h in range(self._hour - HOURS, self._hour):
+            i = h % SLOTS
+            if self._counts[i]:
+                self._total = self._total + self._sums[i] / self._counts[i]
+                self._hours = self._hours + 1
+
+        self._nowcast = self._weigh()
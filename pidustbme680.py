@@ -21,87 +21,8 @@ from Adafruit_IO import Client, RequestError, Feed
 # also import writer for writing CSV logs
 from csv import writer
 
-class sensor:
-    """
-    A class to read a Shinyei PPD42NS Dust Sensor, e.g. as used
-    in the Grove dust sensor.
-    
-    This code calculates the percentage of low pulse time and
-    calibrated concentration in particles per 1/100th of a cubic
-    foot at user chosen intervals.
-    
-    You need to use a voltage divider to cut the sensor output
-    voltage to a Pi safe 3.3V (alternatively use an in-line
-    20k resistor to limit the current at your own risk).
-    """
-
-    def __init__(self, pi, gpio):
-        """
-        Instantiate with the Pi and gpio to which the sensor
-        is connected.
-        """
-        
-        self.pi = pi
-        self.gpio = gpio
-        
-        self._start_tick = None
-        self._last_tick = None
-        self._low_ticks = 0
-        self._high_ticks = 0
-
-        pi.set_mode(gpio, pigpio.INPUT)
-
-        self._cb = pi.callback(gpio, pigpio.EITHER_EDGE, self._cbf)
-
-    # Method for calculating Ratio and Concentration
-    def read(self):
-        """
-        Calculates the percentage low pulse time and calibrated
-        concentration in particles per 1/100th of a cubic foot
-        since the last read.
-
-        For proper calibration readings should be made over
-        30 second intervals.
-        
-        Returns a tuple of gpio, percentage, and concentration.
-        """
-        interval = self._low_ticks + self._high_ticks
-
-        if interval > 0:
-            ratio = float(self._low_ticks)/float(interval)*100.0
-            conc = 1.1*pow(ratio,3)-3.8*pow(ratio,2)+520*ratio+0.62;
-        else:
-            ratio = 0
-            conc = 0.0
-
-        self._start_tick = None
-        self._last_tick = None
-        self._low_ticks = 0
-        self._high_ticks = 0
-
-        return (self.gpio, ratio, conc)
-
-    def _cbf(self, gpio, level, tick):
-
-        if self._start_tick is not None:
-
-            ticks = pigpio.tickDiff(self._last_tick, tick)
-
-            self._last_tick = tick
-
-            if level == 0: # Falling edge.
-                self._high_ticks = self._high_ticks + ticks
-
-            elif level == 1: # Rising edge.
-                self._low_ticks = self._low_ticks + ticks
-
-            else: # timeout level, not used
-                pass
-
-        else:
-            self._start_tick = tick
-            self._last_tick = tick
-         
+# The PPD42NS sensor class is shared with pidustsensor.py
+from pidustsensor import sensor
 
 
 if __name__ == "__main__":
@@ -112,8 +33,22 @@ if __name__ == "__main__":
     import bme680
     import pigpio
     import pidustbme680 # import this script
+    import atexit
+    import humidity
+    import scheduler
+    import signal
+    import storage
     import sys
-    
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Log the PPD42NS dust sensor and BME680 readings.')
+    parser.add_argument('--kappa', type=float, default=humidity.KAPPA,
+                        help='particle hygroscopicity (default %(default)s)')
+    parser.add_argument('--density', type=float, default=humidity.DENSITY,
+                        help='dry particle density in g/cm3 (default %(default)s)')
+    parser.add_argument('--max-humidity', type=float, default=humidity.MAX_HUMIDITY,
+                        help='cap the humidity correction at this %%RH, 0 for none (default %(default)s)')
+    args = parser.parse_args()
       
     # Setup BME680 Sensor
     sensor = bme680.BME680()
@@ -193,6 +128,16 @@ if __name__ == "__main__":
     io_hum = aio.feeds('environment-sensor.hum')
     io_gas = aio.feeds('environment-sensor.gas')
     
+    # Log to SQLite over one connection, committing every 20 readings
+    # (10 minutes) or at most 5 minutes after a reading was taken.
+    # Rows still waiting are committed when the script exits, including
+    # when the system shuts down, whose SIGTERM skips atexit handlers
+    # unless it is turned into a normal exit.
+    db = storage.SQLiteWriter('envirosensorlog.db', storage.ENVIRONMENT_INSERT,
+                              storage.ENVIRONMENT_SCHEMA, batch=20, max_age=300, rollup='environment')
+    atexit.register(db.close)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
     # Sent initial variables to 0 before loop
     
     temp = 0
@@ -200,14 +145,20 @@ if __name__ == "__main__":
     hum = 0
     gas = 0
     
+    # Use 30 for a properly calibrated reading, samples land on :00 and :30
+    schedule = scheduler.SampleScheduler(30)
+    
     # Begin the sampling loop
     
     while True:
         
-        time.sleep(30) # Use 30 for a properly calibrated reading.
+        deadline = schedule.wait()
 
-        # Get the current time of the reading
-        timestamp = datetime.now()
+        # The time of the reading is the deadline it was taken at
+        timestamp = datetime.fromtimestamp(deadline.time)
+
+        if deadline.missed:
+            print("Processing overran, skipped {} readings".format(deadline.missed))
                        
         if sensor.get_sensor_data():
             temp = sensor.data.temperature
@@ -242,13 +193,19 @@ if __name__ == "__main__":
         if c10 == 1114000.62:
             c10 = 0
             
-        # Store values in a variable
-        aqdata = timestamp, r25, int(c25), r10, int(c10), temp, pres, hum, gas
+        # Correct the concentrations for particle growth in humid air, see humidity.py
+        dry25 = humidity.correct(c25, hum, args.kappa, args.density, args.max_humidity)
+        dry10 = humidity.correct(c10, hum, args.kappa, args.density, args.max_humidity)
+
+        # Store values in a variable, the ratios as read and the concentrations corrected
+        aqdata = timestamp, r25, int(dry25), r10, int(dry10), temp, pres, hum, gas
+
+        db.write(storage.record(aqdata))
             
         # Send values to ADAFRUIT.IO or Pass if there's connection error
         try:
-            aio.send_data(io_c25.key, c25)
-            aio.send_data(io_c10.key, c10)
+            aio.send_data(io_c25.key, dry25)
+            aio.send_data(io_c10.key, dry10)
             aio.send_data(io_temp.key, temp)
             aio.send_data(io_pres.key, pres)
             aio.send_data(io_hum.key, hum)
@@ -270,8 +227,8 @@ if __name__ == "__main__":
        
             
         # Print values to console
-        print("Timestamp of Readings = {} \n PM2.5 (P2 or Pin4):  Ratio = {:.1f}, PM > 2.5 µg PCS Conc = {} µg/ft3  \n PM1.0 (P1 or Pin2):   Ratio = {:.1f}, PM > 1.0 µg PCS Conc = {} µg/ft3 \n BME 680 Readings:   Temp = {:.2f} C, Pressure = {:.2f} hPa, Humidity = {:.2f} %RH, Gas Resistance = {} Ohms  \n " .
-            format(timestamp, r25, int(c25), r10, int(c10), temp, pres, hum, gas))
+        print("Timestamp of Readings = {} \n PM2.5 (P2 or Pin4):  Ratio = {:.1f}, PM > 2.5 µg PCS Conc = {} µg/ft3  \n PM1.0 (P1 or Pin2):   Ratio = {:.1f}, PM > 1.0 µg PCS Conc = {} µg/ft3 \n BME 680 Readings:   Temp = {:.2f} C, Pressure = {:.2f} hPa, Humidity = {:.2f} %RH, Gas Resistance = {} Ohms  \n Humidity Corrected:   PM2.5 Conc = {} µg/ft3, PM1.0 Conc = {} µg/ft3 \n " .
+            format(timestamp, r25, int(c25), r10, int(c10), temp, pres, hum, gas, int(dry25), int(dry10)))
            
         # Print
             
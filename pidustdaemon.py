@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+
+# pidustdaemon.py
+# GNU General Public License v3.0
+
+# asyncio based logger for the Shinyei PPD42NS / Grove Dust Sensor and
+# optionally the Pimoroni / BOSCH BME680 breakout.
+#
+# Sampling, the BME680, the CSV / SQLite logs and Adafruit IO uploads
+# run concurrently, so a slow network or SD card never holds up the
+# next sensor window.
+#
+# $ sudo pigpiod
+# $ python3 pidustdaemon.py
+# or with the BME680 and Adafruit IO
+# $ python3 pidustdaemon.py --bme680 --aio-username USER --aio-key KEY
+
+#############################################
+
+import argparse
+import asyncio
+import os
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import pigpio
+
+import aqi
+import conversion
+import csvlog
+import humidity
+import nowcast
+import pidustsensor
+import scheduler
+import storage
+
+# Adafruit IO feed for each value uploaded
+FEEDS = ['c25', 'c10', 'temp', 'pres', 'hum', 'gas']
+
+# Rows waiting to be uploaded, the oldest are dropped beyond this
+UPLOAD_BACKLOG = 120
+
+
+def acquire(loop, readings, schedule, s25, s10, stop):
+    """
+    Runs on its own thread. Closes a window of both sensors at
+    every deadline and hands the readings to the event loop.
+
+    The edges themselves keep arriving on pigpio's thread, this
+    thread only takes the window snapshots so sampling stays on
+    time whatever the event loop is doing.
+    """
+    while not stop.is_set():
+        deadline = schedule.wait()
+
+        g25, r25, c25 = s25.read()
+        g10, r10, c10 = s10.read()
+
+        if deadline.missed:
+            print("Processing overran, skipped {} readings".format(deadline.missed))
+
+        loop.call_soon_threadsafe(readings.put_nowait, (deadline, r25, c25, r10, c10))
+
+
+async def environment(bme, state, period):
+    """
+    Reads the BME680 every period seconds on a worker thread and
+    keeps the latest values in state.
+    """
+    loop = asyncio.get_running_loop()
+
+    while True:
+        if await loop.run_in_executor(None, bme.get_sensor_data):
+            data = bme.data
+            state['temp'] = data.temperature
+            state['pres'] = data.pressure
+            state['hum'] = data.humidity
+            state['gas'] = data.gas_resistance if data.heat_stable else 0
+
+        await asyncio.sleep(period)
+
+
+async def process(readings, state, sinks, kappa=humidity.KAPPA, density=humidity.DENSITY,
+                  ceiling=humidity.MAX_HUMIDITY, calibration25=None, calibration10=None, nowcasts=None):
+    """
+    Turns each set of readings into a log row and passes it on to
+    every sink queue, dropping the oldest row of a full queue.
+
+    Without the BME680 the row is that of pidustsensor.airquality()
+    with the calibration.Calibration of each channel if given, and
+    the µg/m3 are added to nowcasts, a (PM2.5, PM10) pair of
+    nowcast.NowCast, if given. With it the concentrations are
+    corrected for humidity with kappa, density and ceiling, see
+    humidity.correct().
+    """
+    while True:
+        deadline, r25, c25, r10, c10 = await readings.get()
+
+        # The time of the reading is the deadline it was taken at
+        timestamp = datetime.fromtimestamp(deadline.time)
+
+        if state is None:
+            row = pidustsensor.airquality(timestamp, r25, c25, r10, c10, calibration25=calibration25,
+                                          calibration10=calibration10)
+            upload = None
+
+            print("Timestamp = {}, PM2.5 ratio = {:.1f} conc = {}, PM1.0 ratio = {:.1f} conc = {}, "
+                  "PM2.5 AQI = {}, PM10 AQI = {}".format(*row[:5] + row[9:]))
+
+            # Average the µg/m3 over hours for the AQI, as pidustsensor.py
+            if nowcasts is not None:
+                nowcast25, nowcast10 = nowcasts
+                ugm3_pm25, ugm3_pm10 = conversion.reading_ugm3(r25, c25, r10, calibration25=calibration25,
+                                                               calibration10=calibration10)
+                nowcast25.add(deadline.time, ugm3_pm25)
+                nowcast10.add(deadline.time, ugm3_pm10)
+
+                print("NowCast AQI: PM2.5 = {}, PM10 = {}, 24 hour AQI: PM2.5 = {}, PM10 = {}".format(
+                    nowcast25.aqi(), nowcast10.aqi(), nowcast25.aqi24(), nowcast10.aqi24()))
+
+        else:
+            # Fix Errors if the Shinyei PPD42NS  / Grove Dust Sensor Returns an error
+            if r25 == 100.00:
+                r25 = 0
+            if c25 == 1114000.62:
+                c25 = 0
+            if r10 == 100.00:
+                r10 = 0
+            if c10 == 1114000.62:
+                c10 = 0
+
+            c25 = humidity.correct(c25, state['hum'], kappa, density, ceiling)
+            c10 = humidity.correct(c10, state['hum'], kappa, density, ceiling)
+
+            row = (timestamp, r25, int(c25), r10, int(c10),
+                   state['temp'], state['pres'], state['hum'], state['gas'])
+            upload = (c25, c10, state['temp'], state['pres'], state['hum'], state['gas'])
+
+            print("Timestamp = {}, PM2.5 ratio = {:.1f} conc = {}, PM1.0 ratio = {:.1f} conc = {}, "
+                  "Temp = {:.2f} C, Pressure = {:.2f} hPa, Humidity = {:.2f} %RH, Gas = {} Ohms".format(*row))
+
+        for queue, wants in sinks:
+            item = upload if wants == 'upload' else row
+            if item is None:
+                continue
+            if queue.full():
+                queue.get_nowait()
+            queue.put_nowait(item)
+
+
+async def store(rows, csv_path, header, open_db=None, sensor=storage.SENSOR):
+    """
+    Appends each row to the csv log, see csvlog.CSVLog, and if
+    given open_db to the storage.SQLiteWriter or PartitionedWriter
+    it returns, as readings of sensor. The writes run on one worker
+    thread of their own, which also owns the database connection.
+    """
+    loop = asyncio.get_running_loop()
+    io = ThreadPoolExecutor(max_workers=1)
+
+    def open_logs():
+        log = csvlog.CSVLog(csv_path, header)
+        db = open_db() if open_db is not None else None
+        return log, db
+
+    def write(row):
+        log.write(row)
+        if db is not None:
+            db.write(storage.record(row, sensor))
+
+    def close():
+        log.close()
+        if db is not None:
+            db.close()
+
+    log, db = await loop.run_in_executor(io, open_logs)
+
+    try:
+        while True:
+            row = await rows.get()
+            await loop.run_in_executor(io, write, row)
+    finally:
+        # Commit the rows still waiting on the way out
+        io.submit(close).result()
+        io.shutdown()
+
+
+async def upload(values, aio, feeds):
+    """
+    Sends each set of values to Adafruit IO on a worker thread.
+    Failures are reported and the values dropped, they never hold
+    up sampling or logging.
+    """
+    loop = asyncio.get_running_loop()
+
+    while True:
+        row = await values.get()
+
+        try:
+            for feed, value in zip(feeds, row):
+                await loop.run_in_executor(None, aio.send_data, feed.key, value)
+        except Exception as e:
+            print("Adafruit IO upload failed: {}".format(e))
+
+
+def setup_bme680():
+    """
+    Returns a BME680 set up as in pidustbme680.py.
+    """
+    import bme680
+
+    bme = bme680.BME680()
+
+    # These oversampling settings can be tweaked to
+    # change the balance between accuracy and noise in
+    # the data.
+    bme.set_humidity_oversample(bme680.OS_2X)
+    bme.set_pressure_oversample(bme680.OS_4X)
+    bme.set_temperature_oversample(bme680.OS_8X)
+    bme.set_filter(bme680.FILTER_SIZE_3)
+    bme.set_gas_status(bme680.ENABLE_GAS_MEAS)
+
+    bme.set_gas_heater_temperature(320)
+    bme.set_gas_heater_duration(150)
+    bme.select_gas_heater_profile(0)
+
+    return bme
+
+
+def opener(args, table):
+    """
+    Returns the function opening the database of table given by
+    the command line, or None without one.
+    """
+    if args.db_dir:
+        return lambda: storage.PartitionedWriter(args.db_dir, table, args.db_batch, args.db_age,
+                                                 args.db_keep_days)
+
+    if args.db:
+        return lambda: storage.SQLiteWriter(args.db, storage.INSERTS[table], storage.SCHEMAS[table],
+                                            args.db_batch, args.db_age, rollup=table)
+
+    return None
+
+
+async def main(args):
+    loop = asyncio.get_running_loop()
+
+    # Stop cleanly when the system shuts down, so the logs are
+    # flushed and the last rows committed on the way out.
+    loop.add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+
+    pi = pigpio.pi(args.host)
+
+    # PM2.5 on Pin 4 and PM1.0 on Pin 2 of the sensor, Broadcom numbering
+    s25 = pidustsensor.sensor(pi, args.pm25_gpio, glitch=args.glitch)
+    s10 = pidustsensor.sensor(pi, args.pm10_gpio, glitch=args.glitch)
+
+    # Optionally use calibrations fitted by calibration.py, stored by gpio
+    calibrations = {}
+    if args.calibration:
+        import calibration
+        calibrations = calibration.load(args.calibration)
+
+    calibration25 = calibrations.get('gpio{}'.format(args.pm25_gpio))
+    calibration10 = calibrations.get('gpio{}'.format(args.pm10_gpio))
+
+    readings = asyncio.Queue()
+    sinks = []
+    tasks = []
+
+    state = None
+    nowcasts = None
+
+    if args.bme680:
+        bme = setup_bme680()
+        state = {'temp': 0, 'pres': 0, 'hum': 0, 'gas': 0}
+        tasks.append(environment(bme, state, args.bme680_period))
+
+        rows = asyncio.Queue()
+        sinks.append((rows, 'row'))
+        tasks.append(store(rows, args.csv, csvlog.ENVIRONMENT_HEADER, opener(args, 'environment'), args.sensor_id))
+
+        if args.aio_username and args.aio_key:
+            from Adafruit_IO import Client
+
+            aio = Client(args.aio_username, args.aio_key)
+            feeds = [aio.feeds('{}.{}'.format(args.aio_group, name)) for name in FEEDS]
+
+            values = asyncio.Queue(maxsize=UPLOAD_BACKLOG)
+            sinks.append((values, 'upload'))
+            tasks.append(upload(values, aio, feeds))
+
+    else:
+        rows = asyncio.Queue()
+        sinks.append((rows, 'row'))
+        tasks.append(store(rows, args.csv, csvlog.AIRQUALITY_HEADER, opener(args, 'airquality'),
+                           args.sensor_id))
+
+        # NowCast and 24 hour averages for the AQI
+        path25 = path10 = None
+        if args.nowcast_dir:
+            path25 = os.path.join(args.nowcast_dir, 'nowcast_pm25.json')
+            path10 = os.path.join(args.nowcast_dir, 'nowcast_pm10.json')
+        nowcasts = (nowcast.NowCast(aqi.PM25, path25), nowcast.NowCast(aqi.PM10, path10))
+
+    tasks.append(process(readings, state, sinks, args.kappa, args.density, args.max_humidity,
+                         calibration25, calibration10, nowcasts))
+
+    # Use 30 for a properly calibrated reading, samples land on :00 and :30
+    schedule = scheduler.SampleScheduler(args.period)
+    stop = threading.Event()
+
+    sampler = threading.Thread(target=acquire, args=(loop, readings, schedule, s25, s10, stop))
+    sampler.daemon = True
+    sampler.start()
+
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        stop.set()
+        s25.cancel()
+        s10.cancel()
+        pi.stop() # Disconnect from Pi.
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description='Log PPD42NS dust sensor readings with asyncio.')
+    parser.add_argument('--host', default='localhost',
+                        help='pigpio daemon host (default %(default)s)')
+    parser.add_argument('--pm25-gpio', type=int, default=18,
+                        help='gpio of the PM2.5 output, Pin 4 (default %(default)s)')
+    parser.add_argument('--pm10-gpio', type=int, default=17,
+                        help='gpio of the PM1.0 output, Pin 2 (default %(default)s)')
+    parser.add_argument('--period', type=float, default=30,
+                        help='sampling period in seconds (default %(default)s)')
+    parser.add_argument('--glitch', type=int, default=0, metavar='US',
+                        help='ignore pulses shorter than this many microseconds (default %(default)s)')
+    parser.add_argument('--calibration', metavar='FILE',
+                        help='work out µg/m3 with the calibrations of the two gpios in this file')
+    parser.add_argument('--nowcast-dir', metavar='DIR',
+                        help='keep the NowCast hourly averages here across restarts')
+    parser.add_argument('--csv', metavar='FILE',
+                        help='csv log file (default /media/pi/airqualitylog.csv, '
+                             'or /media/pi/envirosensorlog.csv with --bme680)')
+    parser.add_argument('--db', metavar='FILE',
+                        help='also log to this SQLite database')
+    parser.add_argument('--db-dir', metavar='DIR',
+                        help='also log to a SQLite database per month in this directory, instead of --db')
+    parser.add_argument('--db-keep-days', type=float, metavar='DAYS',
+                        help='with --db-dir, drop the readings of months older than this, keeping the rollups')
+    parser.add_argument('--sensor-id', type=int, default=storage.SENSOR,
+                        help='sensor id the readings are stored under (default %(default)s)')
+    parser.add_argument('--db-batch', type=int, default=storage.BATCH_ROWS,
+                        help='rows committed to the database at a time (default %(default)s)')
+    parser.add_argument('--db-age', type=float, default=storage.BATCH_SECONDS,
+                        help='commit rows once the oldest has waited this many seconds (default %(default)s)')
+    parser.add_argument('--bme680', action='store_true',
+                        help='log the BME680 alongside the dust sensor')
+    parser.add_argument('--bme680-period', type=float, default=5,
+                        help='seconds between BME680 reads (default %(default)s)')
+    parser.add_argument('--kappa', type=float, default=humidity.KAPPA,
+                        help='particle hygroscopicity, with --bme680 (default %(default)s)')
+    parser.add_argument('--density', type=float, default=humidity.DENSITY,
+                        help='dry particle density in g/cm3, with --bme680 (default %(default)s)')
+    parser.add_argument('--max-humidity', type=float, default=humidity.MAX_HUMIDITY,
+                        help='cap the humidity correction at this %%RH, 0 for none (default %(default)s)')
+    parser.add_argument('--aio-username', default=os.environ.get('ADAFRUIT_IO_USERNAME'),
+                        help='Adafruit IO username (default $ADAFRUIT_IO_USERNAME)')
+    parser.add_argument('--aio-key', default=os.environ.get('ADAFRUIT_IO_KEY'),
+                        help='Adafruit IO key (default $ADAFRUIT_IO_KEY)')
+    parser.add_argument('--aio-group', default='environment-sensor',
+                        help='Adafruit IO feed group (default %(default)s)')
+    args = parser.parse_args()
+
+    # The environment rows have their own columns, keep them out of
+    # the air quality log.
+    if args.csv is None:
+        args.csv = '/media/pi/envirosensorlog.csv' if args.bme680 else '/media/pi/airqualitylog.csv'
+
+    try:
+        asyncio.run(main(args))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
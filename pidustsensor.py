@@ -10,9 +10,133 @@
 
 from __future__ import print_function
 import math
+import struct
+import time
+from array import array
+import threading
+from collections import namedtuple, deque
 import pigpio
-# also import writer for writing CSV logs
-from csv import writer
+import aqi
+import conversion
+
+# pigpio notification reports, see pi.notify_open()
+# H seqno, H flags, I tick, I level (bits 0-31 for each gpio)
+NOTIFY_REPORT = struct.Struct('<HHII')
+
+# Read the notification pipe in blocks of this many reports
+NOTIFY_BLOCK_REPORTS = 512
+
+# Low pulse widths are binned by eighth of an octave, on the bit length
+# and the next 3 bits of the width in microseconds, from 2**12 (4.1 ms)
+# up to 2**18 (262 ms) which spans the PPD42NS pulses of roughly 10 to
+# 90 ms. Bin 0 counts shorter pulses and the last bin longer ones.
+HISTOGRAM_LOW_BITS = 12
+HISTOGRAM_HIGH_BITS = 18
+HISTOGRAM_LOW = 1 << HISTOGRAM_LOW_BITS
+HISTOGRAM_HIGH = 1 << HISTOGRAM_HIGH_BITS
+HISTOGRAM_BINS = (HISTOGRAM_HIGH_BITS - HISTOGRAM_LOW_BITS) * 8 + 2
+
+# A sampling window as returned by sensor.read_window()
+Window = namedtuple('Window', 'gpio ratio conc low_ticks high_ticks histogram '
+                               'start_tick end_tick start_time end_time rejected')
+
+# Edge path timing as returned by sensor.read_latency(). delay is the
+# time in microseconds from an edge's tick to its handling starting,
+# from the samples taken, and exec the time in microseconds taken to
+# handle an edge, over all edges. Each is given as min, p50, p99 and
+# max, or None without any measurement.
+Latency = namedtuple('Latency', 'gpio edges samples delay_min delay_p50 delay_p99 delay_max '
+                                'exec_min exec_p50 exec_p99 exec_max')
+
+
+def _notify(pi, bits, pump):
+    """
+    Opens a pigpio notification handle for the gpios in bits and
+    starts a thread feeding its pipe to pump. Returns the handle.
+    """
+    handle = pi.notify_open()
+    pipe = open('/dev/pigpio{}'.format(handle), 'rb', buffering=0)
+    pi.notify_begin(handle, bits)
+
+    thread = threading.Thread(target=pump, args=(pipe,))
+    thread.daemon = True
+    thread.start()
+
+    return handle
+
+
+def _pump(pipe, ingest):
+    """
+    Reads notification reports from pipe until end of file and
+    passes them to ingest a block at a time, decoded into
+    (seqno, flags, tick, levels) tuples.
+    """
+    size = NOTIFY_REPORT.size
+    pending = b''
+
+    while True:
+        data = pipe.read(size * NOTIFY_BLOCK_REPORTS)
+        if not data:
+            break
+
+        if pending:
+            data = pending + data
+
+        # Reads from a pipe may split a report, keep the tail
+        # for the next block.
+        whole = len(data) - len(data) % size
+        pending = data[whole:]
+
+        if whole:
+            ingest(list(NOTIFY_REPORT.iter_unpack(memoryview(data)[:whole])))
+
+    pipe.close()
+
+
+def histogram_bin(ticks):
+    """
+    Returns the histogram bin of a low pulse of ticks microseconds.
+    """
+    if ticks < HISTOGRAM_LOW:
+        return 0
+
+    if ticks >= HISTOGRAM_HIGH:
+        return HISTOGRAM_BINS - 1
+
+    n = ticks.bit_length()
+
+    return ((n - HISTOGRAM_LOW_BITS - 1) << 3 | (ticks >> (n - 4)) & 7) + 1
+
+
+def histogram_bins():
+    """
+    Returns a list of the (shortest, longest) low pulse width in
+    microseconds counted by each histogram bin.
+    """
+    bins = [(0, HISTOGRAM_LOW - 1)]
+
+    for n in range(HISTOGRAM_LOW_BITS + 1, HISTOGRAM_HIGH_BITS + 1):
+        for step in range(8):
+            bins.append(((8 + step) << (n - 4), ((9 + step) << (n - 4)) - 1))
+
+    bins.append((HISTOGRAM_HIGH, 0xFFFFFFFF))
+
+    return bins
+
+
+def _percentiles(values):
+    """
+    Returns the min, median, 99th percentile and max of values by
+    nearest rank, or four Nones if there are none.
+    """
+    if not values:
+        return (None, None, None, None)
+
+    values = sorted(values)
+    n = len(values)
+
+    return (values[0], values[(n + 1) // 2 - 1], values[int(math.ceil(0.99 * n)) - 1], values[-1])
+
 
 class sensor:
     """
@@ -28,23 +152,168 @@ class sensor:
     20k resistor to limit the current at your own risk).
     """
 
-    def __init__(self, pi, gpio):
+    # Every edge goes through _cbf(), fixed slots keep its attribute
+    # lookups cheap and the sensor small.
+    __slots__ = ('pi', 'gpio', '_first_tick', '_last_tick', '_level', '_capture', '_clock',
+                 '_totals', '_read_totals', '_min_pulse', '_pending', '_raw_level',
+                 '_rejected', '_read_rejected', '_latency', '_exec_times', '_delays',
+                 '_countdown', '_plain', '_histogram', '_read_histogram', '_rolling',
+                 '_bucket_ticks', '_bucket', '_elapsed', '_ring_low', '_ring_high',
+                 '_cb', '_handle', '_watchdog', '_glitch')
+
+    def __init__(self, pi, gpio, notify=False, capture=None, rolling=None, bucket=1.0,
+                 watchdog=60000, clock=None, attach=True, glitch=0, min_pulse=0, latency=0):
         """
         Instantiate with the Pi and gpio to which the sensor
         is connected.
+
+        By default every edge is delivered through a pigpio
+        callback. With notify=True the sensor instead opens a
+        pigpio notification pipe and decodes the level change
+        reports in blocks on its own thread, which costs far
+        less CPU per edge. Pipes only exist on the local Pi.
+
+        capture may be an EdgeCapture which will be given every
+        edge seen, it may be shared between sensors.
+
+        rolling, if given, is the length in seconds of a sliding
+        window kept alongside the read() windows in buckets of
+        bucket seconds, see read_rolling().
+
+        watchdog is the longest time in milliseconds (at most
+        60000) without a report from the gpio. pigpio reports a
+        timeout when it passes, which keeps the tick totals exact
+        however long the gpio stays at one level. 0 disables it.
+
+        clock may be a TickClock, which read_window() then uses
+        to place windows in the clock's 64 bit tick domain and to
+        give their wall clock start and end.
+
+        With attach=False neither a callback nor a pipe is set
+        up and edges must be passed in by the caller, as done
+        by SensorArray.
+
+        glitch asks pigpio to ignore level changes shorter than
+        that many microseconds before they reach Python, which
+        saves the callbacks as well as cleaning the data. Where
+        the daemon or pi has no glitch filter it is done in
+        software instead. min_pulse drops, in software, any pulse
+        shorter than that many microseconds. Edges dropped in
+        software are counted per window, see read_window().
+
+        latency, if not 0, times the edge path. Every edge's
+        handling is timed and every latency'th edge (or block
+        of reports with notify=True) has its delay measured by
+        asking pigpio for the current tick, see read_latency().
+        That is a round trip to the daemon so keep it sparse.
         """
         
         self.pi = pi
         self.gpio = gpio
         
-        self._start_tick = None
+        self._first_tick = None
         self._last_tick = None
-        self._low_ticks = 0
-        self._high_ticks = 0
+        self._level = None
+        self._capture = capture
+        self._clock = clock
+
+        # Running (low, high) tick totals and the tick they run to.
+        # The callback thread is the only writer and always publishes
+        # a fresh tuple, so read() sees all three from the same edge
+        # without taking a lock.
+        self._totals = (0, 0, None)
+
+        # Totals as of the previous read, the start of the current window.
+        self._read_totals = (0, 0, None)
+
+        # Software pulse filter, the edge waiting to be confirmed by
+        # the next one arriving at least min_pulse later, the last
+        # level seen on the pipe, and the count of edges dropped.
+        self._min_pulse = min_pulse
+        self._pending = None
+        self._raw_level = None
+        self._rejected = 0
+        self._read_rejected = 0
+
+        # Edge path timing for the current window, handling times in
+        # microseconds, sampled delays in ticks, and the edges to go
+        # until the next delay sample.
+        self._latency = latency
+        self._exec_times = array('d')
+        self._delays = array('I')
+        self._countdown = latency
+
+        # Whether pigpiod filters glitches on the gpio for us,
+        # cleared again by cancel().
+        self._glitch = False
+
+        if glitch:
+            try:
+                if pi.set_glitch_filter(gpio, glitch) != 0:
+                    raise ValueError('glitch filter not set')
+                self._glitch = True
+            except (AttributeError, ValueError, pigpio.error):
+                self._min_pulse = max(min_pulse, glitch)
+
+        # Running count of low pulses in each width bin, and the
+        # counts as of the previous read.
+        self._histogram = array('Q', [0]) * HISTOGRAM_BINS
+        self._read_histogram = array('Q', [0]) * HISTOGRAM_BINS
+
+        # Sliding window, low and high ticks per bucket in a ring
+        # indexed by bucket number, and (low, high) tick sums over
+        # the ring published like _totals.
+        self._rolling = None
+
+        if rolling:
+            buckets = max(int(round(float(rolling) / bucket)), 1)
+            self._bucket_ticks = int(bucket * 1000000)
+            self._bucket = 0
+            self._elapsed = 0
+            self._ring_low = array('Q', [0]) * buckets
+            self._ring_high = array('Q', [0]) * buckets
+            self._rolling = (0, 0)
+
+        # Nothing but the totals to keep, _cbf() takes its fast path.
+        self._plain = capture is None and not self._min_pulse and not latency
 
         pi.set_mode(gpio, pigpio.INPUT)
 
-        self._cb = pi.callback(gpio, pigpio.EITHER_EDGE, self._cbf)
+        self._watchdog = watchdog
+        if watchdog:
+            pi.set_watchdog(gpio, watchdog)
+
+        self._cb = None
+        self._handle = None
+
+        if attach and notify:
+            self._handle = _notify(pi, 1 << gpio, self.pump)
+
+        elif attach:
+            self._cb = pi.callback(gpio, pigpio.EITHER_EDGE, self._cbf)
+
+    def cancel(self):
+        """
+        Stops delivery of edges to the sensor and clears the
+        watchdog and glitch filter it set on the gpio, which
+        pigpiod would otherwise keep for its other clients.
+        """
+        if self._cb is not None:
+            self._cb.cancel()
+            self._cb = None
+
+        if self._handle is not None:
+            # Closing the handle closes the pipe and ends pump().
+            self.pi.notify_close(self._handle)
+            self._handle = None
+
+        if self._watchdog:
+            self.pi.set_watchdog(self.gpio, 0)
+            self._watchdog = 0
+
+        if self._glitch:
+            self.pi.set_glitch_filter(self.gpio, 0)
+            self._glitch = False
 
     # Method for calculating Ratio and Concentration
     def read(self):
@@ -58,44 +327,850 @@ class sensor:
         
         Returns a tuple of gpio, percentage, and concentration.
         """
-        interval = self._low_ticks + self._high_ticks
+        return tuple(self.read_window()[:3])
+
+    def read_window(self):
+        """
+        As read() but returns a Window which also holds the low
+        and high ticks of the window, the number of low pulses
+        in each width bin, see histogram_bins(), and the number
+        of edges the software pulse filter rejected.
+
+        The window runs from the last edge before the previous
+        read to the last edge before this one, start_tick and
+        end_tick are those edges' ticks extended to 64 bits so
+        windows of any length can be taken. With a clock they are
+        in the clock's tick domain and start_time and end_time
+        give the matching wall clock time in seconds, otherwise
+        the times are None. All four are None before the first
+        edge.
+
+        The window is swapped rather than reset, the callback keeps
+        adding to the running totals while this runs and any edge
+        that lands after the snapshot is counted in the next window.
+        """
+        totals = self._totals # Snapshot the active window in one read.
+        histogram = array('Q', self._histogram)
+
+        read_totals = self._read_totals
+        low_ticks = totals[0] - read_totals[0]
+        high_ticks = totals[1] - read_totals[1]
+        self._read_totals = totals
+
+        window_histogram = [n - m for n, m in zip(histogram, self._read_histogram)]
+        self._read_histogram = histogram
+
+        rejected = self._rejected
+        window_rejected = rejected - self._read_rejected
+        self._read_rejected = rejected
+
+        ratio, conc = self._convert(low_ticks, high_ticks)
+
+        start_tick = end_tick = start_time = end_time = None
+
+        if totals[2] is not None:
+
+            clock = self._clock
+
+            if clock is not None:
+                # The last edge is at most a watchdog period old so
+                # its tick extends unambiguously.
+                clock.sample()
+                end_tick = clock.extend(totals[2])
+                start_tick = end_tick - low_ticks - high_ticks
+
+                start_time = clock.time_of(start_tick)
+                end_time = clock.time_of(end_tick)
+
+            else:
+                # The totals add up to the ticks since the first edge.
+                start_tick = self._first_tick + read_totals[0] + read_totals[1]
+                end_tick = self._first_tick + totals[0] + totals[1]
+
+        return Window(self.gpio, ratio, conc, low_ticks, high_ticks, window_histogram,
+                      start_tick, end_tick, start_time, end_time, window_rejected)
+
+    def read_latency(self):
+        """
+        Returns a Latency for the edges handled since the previous
+        call, which starts a new measurement window.
+
+        A delay that grows under load means edges are queueing in
+        pigpio before they are handled.
+        """
+        if not self._latency:
+            raise ValueError('sensor was created without latency timing')
+
+        # Swap in fresh arrays, the callback appends to whichever
+        # it finds.
+        exec_times = self._exec_times
+        delays = self._delays
+        self._exec_times = array('d')
+        self._delays = array('I')
+
+        return Latency(self.gpio, len(exec_times), len(delays),
+                       *(_percentiles(delays) + _percentiles(exec_times)))
+
+    def read_rolling(self):
+        """
+        Returns a tuple of gpio, percentage, and concentration
+        over the sliding window, which ends at the latest edge.
+
+        Unlike read() this does not start a new window so it may
+        be called as often as wanted, it only reads the running
+        sums kept by the callback.
+        """
+        if self._rolling is None:
+            raise ValueError('sensor was created without a rolling window')
+
+        low_ticks, high_ticks = self._rolling
+
+        ratio, conc = self._convert(low_ticks, high_ticks)
+
+        return (self.gpio, ratio, conc)
+
+    def _convert(self, low_ticks, high_ticks):
+        """
+        Returns the percentage low pulse time and calibrated
+        concentration for the given low and high ticks.
+        """
+        interval = low_ticks + high_ticks
 
         if interval > 0:
-            ratio = float(self._low_ticks)/float(interval)*100.0
-            conc = 1.1*pow(ratio,3)-3.8*pow(ratio,2)+520*ratio+0.62;
+            ratio = float(low_ticks)/float(interval)*100.0
+            conc = conversion.concentration(ratio)
         else:
             ratio = 0
             conc = 0.0
 
-        self._start_tick = None
-        self._last_tick = None
-        self._low_ticks = 0
-        self._high_ticks = 0
+        return (ratio, conc)
 
-        return (self.gpio, ratio, conc)
+    def _roll(self, low, ticks):
+        """
+        Adds the low or high ticks up to an edge to the sliding
+        window, splitting them over the buckets they span and
+        expiring buckets which fall out of the window.
+        """
+        ring_low = self._ring_low
+        ring_high = self._ring_high
+        ring = ring_low if low else ring_high
+        buckets = len(ring_low)
+        size = self._bucket_ticks
+
+        low_sum, high_sum = self._rolling
+        bucket = self._bucket
+        elapsed = self._elapsed
+        end = elapsed + ticks
+
+        # Oldest bucket still in the window once this interval is added.
+        first = end // size - buckets + 1
+
+        if bucket < first:
+            # The interval covers the whole window, start it afresh.
+            for i in range(buckets):
+                ring_low[i] = 0
+                ring_high[i] = 0
+            low_sum = high_sum = 0
+            bucket = first
+            elapsed = max(elapsed, first * size)
+
+        while True:
+            boundary = (bucket + 1) * size
+            part = min(end, boundary) - elapsed
+
+            ring[bucket % buckets] += part
+            if low:
+                low_sum = low_sum + part
+            else:
+                high_sum = high_sum + part
+
+            if end < boundary:
+                break
+
+            # Move to the next bucket, dropping what it held a
+            # whole window ago.
+            elapsed = boundary
+            bucket = bucket + 1
+            i = bucket % buckets
+            low_sum = low_sum - ring_low[i]
+            high_sum = high_sum - ring_high[i]
+            ring_low[i] = 0
+            ring_high[i] = 0
+
+        self._bucket = bucket
+        self._elapsed = end
+        self._rolling = (low_sum, high_sum)
 
     def _cbf(self, gpio, level, tick):
 
-        if self._start_tick is not None:
+        if not self._plain:
+            self._deliver(gpio, level, tick)
+            return
 
-            ticks = pigpio.tickDiff(self._last_tick, tick)
+        # Fast path, _edge() inlined for a plain level change.
+        last_tick = self._last_tick
 
-            self._last_tick = tick
+        if last_tick is None or level == 2: # pigpio.TIMEOUT
+            self._edge(level, tick)
+            return
 
-            if level == 0: # Falling edge.
-                self._high_ticks = self._high_ticks + ticks
+        ticks = (tick - last_tick) & 0xFFFFFFFF # pigpio.tickDiff()
 
-            elif level == 1: # Rising edge.
-                self._low_ticks = self._low_ticks + ticks
+        self._last_tick = tick
+        self._level = level
 
-            else: # timeout level, not used
-                pass
+        low_ticks, high_ticks, last = self._totals
+
+        if level: # A rising edge ends a low pulse.
+            self._histogram[histogram_bin(ticks)] += 1
+            self._totals = (low_ticks + ticks, high_ticks, tick)
+
+        else:
+            self._totals = (low_ticks, high_ticks + ticks, tick)
+
+        if self._rolling is not None:
+            self._roll(level, ticks)
+
+    def _deliver(self, gpio, level, tick):
+        """
+        Passes an edge to the capture, filter and timing as set up.
+        """
+        if self._latency:
+            self._timed(gpio, level, tick)
+            return
+
+        if self._capture is not None:
+            self._capture.record(gpio, level, tick)
+
+        if self._min_pulse:
+            self._filter(level, tick)
+
+        else:
+            self._edge(level, tick)
+
+    def _timed(self, gpio, level, tick):
+        """
+        As _cbf() but times the handling of the edge and samples
+        its delay.
+        """
+        start = time.perf_counter()
+
+        if self._capture is not None:
+            self._capture.record(gpio, level, tick)
+
+        if self._min_pulse:
+            self._filter(level, tick)
 
         else:
-            self._start_tick = tick
+            self._edge(level, tick)
+
+        self._exec_times.append((time.perf_counter() - start) * 1000000.0)
+
+        self._countdown = self._countdown - 1
+        if self._countdown <= 0:
+            self._countdown = self._latency
+            self._delays.append(pigpio.tickDiff(tick, self.pi.get_current_tick()))
+
+    def _filter(self, level, tick):
+        """
+        Holds each edge back until the next one shows the pulse it
+        starts is at least min_pulse long. A shorter pulse is a
+        glitch and both of its edges are dropped, as is any edge
+        which does not change the level.
+        """
+        pending = self._pending
+
+        if level == pigpio.TIMEOUT:
+            if pending is not None:
+                self._pending = None
+                self._edge(*pending)
+            self._edge(level, tick)
+            return
+
+        if pending is not None:
+            self._pending = None
+
+            if (tick - pending[1]) & 0xFFFFFFFF < self._min_pulse:
+                self._rejected = self._rejected + 2
+                return
+
+            self._edge(*pending)
+
+        if level == self._level:
+            self._rejected = self._rejected + 1
+            return
+
+        self._pending = (level, tick)
+
+    def _edge(self, level, tick):
+        """
+        Adds the ticks since the previous edge to the totals.
+        """
+        if self._last_tick is not None:
+
+            ticks = (tick - self._last_tick) & 0xFFFFFFFF
+
+            self._last_tick = tick
+
+            if level == pigpio.TIMEOUT: # Watchdog, the level is unchanged.
+                low = self._level == 0
+
+            else: # A rising edge ends a low pulse.
+                low = level == 1
+                self._level = level
+
+            low_ticks, high_ticks, last = self._totals
+
+            if low:
+                if level == 1:
+                    self._histogram[histogram_bin(ticks)] += 1
+                self._totals = (low_ticks + ticks, high_ticks, tick)
+
+            else:
+                self._totals = (low_ticks, high_ticks + ticks, tick)
+
+            if self._rolling is not None:
+                self._roll(low, ticks)
+
+        elif level != pigpio.TIMEOUT:
+            self._first_tick = tick
             self._last_tick = tick
+            self._level = level
+            self._totals = (0, 0, tick)
+
+    def pump(self, pipe):
+        """
+        Reads notification reports from pipe until end of file,
+        processing them a block at a time.
+
+        pipe may be the pigpio notification pipe or any binary
+        file object, e.g. a recording of the pipe.
+        """
+        _pump(pipe, self._ingest)
+
+    def _ingest(self, reports):
+        """
+        Adds the level changes of this sensor's gpio in a block
+        of decoded notification reports to the running totals,
+        publishing the totals once for the whole block.
+        """
+        if self._latency:
+            start = time.perf_counter()
+
+        if self._min_pulse:
+            self._ingest_filtered(reports)
+
+        else:
+            self._ingest_edges(reports)
+
+        if self._latency and reports:
+            # Share the block's handling time out over its reports,
+            # and sample the delay of its oldest report.
+            each = (time.perf_counter() - start) * 1000000.0 / len(reports)
+            self._exec_times.extend([each] * len(reports))
+
+            self._countdown = self._countdown - 1
+            if self._countdown <= 0:
+                self._countdown = self._latency
+                self._delays.append(pigpio.tickDiff(reports[0][2], self.pi.get_current_tick()))
+
+    def _ingest_edges(self, reports):
+        """
+        Adds the level changes in reports to the totals.
+        """
+        gpio = self.gpio
+        capture = self._capture
+        histogram = self._histogram
+        roll = self._roll if self._rolling is not None else None
+        wdog = pigpio.NTFY_FLAGS_WDOG
+        gpio_mask = pigpio.NTFY_FLAGS_GPIO
+        timeout = pigpio.TIMEOUT
+        last_tick = self._last_tick
+        last_level = self._level
+        low_ticks, high_ticks, last = self._totals
+
+        for seqno, flags, tick, levels in reports:
+
+            if flags:
+                # Of keep alive, watchdog and event reports only a
+                # watchdog timeout on this gpio matters, it reports
+                # time passed at an unchanged level.
+                if not flags & wdog:
+                    continue
+
+                if (flags & gpio_mask) != gpio or last_level is None:
+                    continue
+
+                level = timeout
+                low = last_level == 0
+
+            else:
+                level = (levels >> gpio) & 1
+
+                if level == last_level: # another gpio changed
+                    continue
+
+                low = level == 1 # A rising edge ends a low pulse.
+
+            if capture is not None:
+                capture.record(gpio, level, tick)
+
+            if last_tick is not None:
+
+                ticks = (tick - last_tick) & 0xFFFFFFFF # pigpio.tickDiff()
+
+                if low:
+                    if level == 1:
+                        histogram[histogram_bin(ticks)] += 1
+                    low_ticks = low_ticks + ticks
+
+                else:
+                    high_ticks = high_ticks + ticks
+
+                if roll is not None:
+                    roll(low, ticks)
+
+            else:
+                self._first_tick = tick
+
+            last_tick = tick
+
+            if level != timeout:
+                last_level = level
+
+        self._last_tick = last_tick
+        self._level = last_level
+        self._totals = (low_ticks, high_ticks, last_tick)
+
+    def _ingest_filtered(self, reports):
+        """
+        As _ingest() but passes each level change through the
+        software pulse filter.
+        """
+        gpio = self.gpio
+        bit = 1 << gpio
+        capture = self._capture
+        raw_level = self._raw_level
+
+        for seqno, flags, tick, levels in reports:
+
+            if flags:
+                if not flags & pigpio.NTFY_FLAGS_WDOG:
+                    continue
+
+                if (flags & pigpio.NTFY_FLAGS_GPIO) != gpio:
+                    continue
+
+                level = pigpio.TIMEOUT
+
+            else:
+                level = 1 if levels & bit else 0
+
+                if level == raw_level: # another gpio changed
+                    continue
+
+                raw_level = level
+
+            if capture is not None:
+                capture.record(gpio, level, tick)
+
+            self._filter(level, tick)
+
+        self._raw_level = raw_level
          
 
+class SensorArray:
+    """
+    A group of sensors on one Pi sharing a single edge dispatcher.
+
+    The sensors are held in a table indexed by gpio. In callback
+    mode each sensor's own callback is registered for its gpio
+    (pigpio needs a registration per gpio), so edges go straight
+    to it. With notify=True a single notification pipe covers
+    every gpio, each block of reports is decoded once and each
+    report is handed only to the sensors whose level it changes,
+    found by XOR with the previous levels, so the cost follows
+    the edges rather than the number of channels.
+    """
+
+    def __init__(self, pi, gpios, notify=False, **options):
+        """
+        Instantiate with the Pi and the gpios to which sensors
+        are connected. Other keyword options are passed to each
+        sensor, see sensor.
+        """
+        self.pi = pi
+        self.gpios = list(gpios)
+
+        self._table = [None] * 32
+        self._sensors = []
+
+        for gpio in self.gpios:
+            s = sensor(pi, gpio, attach=False, **options)
+            self._table[gpio] = s
+            self._sensors.append(s)
+
+        self._cbs = []
+        self._handle = None
+
+        # Gpio levels of the last report, None before the first.
+        self._bits = 0
+        self._levels = None
+
+        for gpio in self.gpios:
+            self._bits = self._bits | 1 << gpio
+
+        if notify:
+            self._handle = _notify(pi, self._bits, self.pump)
+
+        else:
+            for s in self._sensors:
+                self._cbs.append(pi.callback(s.gpio, pigpio.EITHER_EDGE, s._cbf))
+
+    def __getitem__(self, gpio):
+        """
+        Returns the sensor on gpio.
+        """
+        s = self._table[gpio]
+        if s is None:
+            raise KeyError(gpio)
+        return s
+
+    def __iter__(self):
+        return iter(self._sensors)
+
+    def __len__(self):
+        return len(self._sensors)
+
+    def read(self):
+        """
+        Returns a list of (gpio, percentage, concentration) tuples,
+        one per sensor in gpio order as given, see sensor.read().
+        """
+        return [s.read() for s in self._sensors]
+
+    def read_windows(self):
+        """
+        Returns a list of Windows, one per sensor, see
+        sensor.read_window().
+        """
+        return [s.read_window() for s in self._sensors]
+
+    def read_latencies(self):
+        """
+        Returns a list of Latency tuples, one per sensor, see
+        sensor.read_latency().
+        """
+        return [s.read_latency() for s in self._sensors]
+
+    def cancel(self):
+        """
+        Stops delivery of edges to the sensors and clears their
+        gpio settings, see sensor.cancel().
+        """
+        for cb in self._cbs:
+            cb.cancel()
+        self._cbs = []
+
+        if self._handle is not None:
+            self.pi.notify_close(self._handle)
+            self._handle = None
+
+        for s in self._sensors:
+            s.cancel()
+
+    def pump(self, pipe):
+        """
+        Reads notification reports for all the gpios from pipe
+        until end of file, see sensor.pump().
+        """
+        _pump(pipe, self._ingest)
+
+    def _ingest(self, reports):
+        """
+        Splits a block of reports by the gpios each changes, or
+        the gpio of a watchdog timeout, and passes each sensor its
+        share in one call.
+        """
+        bits = self._bits
+        previous = self._levels
+        shares = dict((gpio, []) for gpio in self.gpios)
+
+        if previous is None:
+            # Every gpio changes with the first report.
+            previous = reports[0][3] ^ bits
+
+        for report in reports:
+            seqno, flags, tick, levels = report
+
+            if flags:
+                # Of keep alive, watchdog and event reports only a
+                # watchdog timeout on one of the gpios matters.
+                if flags & pigpio.NTFY_FLAGS_WDOG:
+                    share = shares.get(flags & pigpio.NTFY_FLAGS_GPIO)
+                    if share is not None:
+                        share.append(report)
+                continue
+
+            changed = (levels ^ previous) & bits
+            previous = levels
+
+            if not changed & (changed - 1): # at most one gpio, the usual case
+                if changed:
+                    shares[changed.bit_length() - 1].append(report)
+                continue
+
+            while changed:
+                lowest = changed & -changed
+                shares[lowest.bit_length() - 1].append(report)
+                changed = changed ^ lowest
+
+        self._levels = previous
+
+        table = self._table
+        for gpio, share in shares.items():
+            if share:
+                table[gpio]._ingest(share)
+
+
+class TickClock:
+    """
+    Maps pigpio ticks to wall clock time.
+
+    pigpio ticks are microseconds since boot and wrap every 72
+    minutes. Each sample() reads the current tick and the wall
+    clock together, extends the tick to 64 bits and keeps it as
+    an anchor. Times are then interpolated from the oldest and
+    newest anchors kept, which corrects for the drift between
+    the tick counter and the wall clock.
+    """
+
+    def __init__(self, pi, timer=time.time, history=64):
+        """
+        Instantiate with the Pi, the wall clock to use and the
+        number of anchors to keep. sample() should be called at
+        least once an hour so no wrap is missed.
+        """
+        self.pi = pi
+        self._timer = timer
+        self._anchors = deque(maxlen=history)
+
+        self._last_tick = None
+        self._extended = None
+
+        self.sample()
+
+    def sample(self):
+        """
+        Adds an anchor for the current tick.
+        """
+        before = self._timer()
+        tick = self.pi.get_current_tick()
+        after = self._timer()
+
+        if self._last_tick is None:
+            extended = tick
+        else: # Time only moves forward between samples.
+            extended = self._extended + pigpio.tickDiff(self._last_tick, tick)
+
+        self._last_tick = tick
+        self._extended = extended
+        self._anchors.append((extended, (before + after) / 2.0))
+
+    def extend(self, tick):
+        """
+        Returns the 64 bit tick for a 32 bit tick taken within
+        about half an hour either side of the latest sample.
+        """
+        if self._last_tick is None:
+            return tick
+
+        diff = (tick - self._last_tick) & 0xFFFFFFFF
+        if diff >= 0x80000000: # tick is before the sample
+            diff = diff - 0x100000000
+
+        return self._extended + diff
+
+    def time_of(self, extended):
+        """
+        Returns the wall clock time in seconds of a 64 bit tick.
+        """
+        first_tick, first_time = self._anchors[0]
+        last_tick, last_time = self._anchors[-1]
+
+        if last_tick > first_tick:
+            rate = (last_time - first_time) / (last_tick - first_tick)
+        else:
+            rate = 0.000001
+
+        return last_time + (extended - last_tick) * rate
+
+
+class EdgeCapture:
+    """
+    A ring buffer holding the most recent raw edges seen by one
+    or more sensors, optionally spooled to a binary file.
+
+    The ring is allocated up front and each edge is stored as two
+    unsigned 32 bit words, the tick and (gpio << 2 | level), so
+    recording an edge never allocates and capture can be left on.
+    A spool file is a plain sequence of those word pairs in the
+    machine's byte order and may be read back with read_capture().
+    """
+
+    def __init__(self, size=65536, spool=None):
+        """
+        Instantiate with the number of edges to hold, rounded up
+        to a power of two, and an optional spool file name which
+        is appended to.
+        """
+        size = 1 << max(size - 1, 1).bit_length()
+
+        self._mask = size - 1
+        self._ring = array('I', [0]) * (2 * size)
+
+        # Edges ever recorded, only written by the callback thread.
+        self._count = 0
+
+        # Edges already written to the spool file.
+        self._spooled = 0
+
+        # Edges overwritten before they could be spooled.
+        self.overruns = 0
+
+        self._spool = open(spool, 'ab') if spool else None
+
+    def record(self, gpio, level, tick):
+        """
+        Records one edge.
+        """
+        count = self._count
+        i = (count & self._mask) << 1
+        ring = self._ring
+        ring[i] = tick
+        ring[i + 1] = gpio << 2 | level
+        self._count = count + 1
+
+    def edges(self):
+        """
+        Returns a list of the (gpio, level, tick) edges held in
+        the ring, oldest first.
+        """
+        count = self._count
+        ring = self._ring
+        size = self._mask + 1
+
+        result = []
+
+        for n in range(max(count - size, 0), count):
+            i = (n & self._mask) << 1
+            word = ring[i + 1]
+            result.append((word >> 2, word & 3, ring[i]))
+
+        return result
+
+    def flush(self):
+        """
+        Appends the edges recorded since the last flush to the
+        spool file. Call from the sampling loop, not the callback.
+        """
+        if self._spool is None:
+            return
+
+        count = self._count
+        start = self._spooled
+        size = self._mask + 1
+
+        if count - start > size:
+            self.overruns = self.overruns + count - start - size
+            start = count - size
+
+        ring = memoryview(self._ring)
+
+        while start < count:
+            # Write up to the end of the ring, then wrap.
+            i = start & self._mask
+            n = min(count - start, size - i)
+            self._spool.write(ring[2 * i:2 * (i + n)])
+            start = start + n
+
+        self._spool.flush()
+        self._spooled = count
+
+    def close(self):
+        """
+        Flushes and closes the spool file.
+        """
+        if self._spool is not None:
+            self.flush()
+            self._spool.close()
+            self._spool = None
+
+
+def read_capture(filename, block=65536):
+    """
+    Yields the (gpio, level, tick) edges stored in an EdgeCapture
+    spool file, reading it block edges at a time.
+    """
+    with open(filename, 'rb') as f:
+        while True:
+            words = array('I')
+            try:
+                words.fromfile(f, 2 * block)
+            except EOFError: # short final block, words holds the rest
+                pass
+
+            for i in range(0, len(words) - 1, 2):
+                word = words[i + 1]
+                yield (word >> 2, word & 3, words[i])
+
+            if len(words) < 2 * block:
+                break
+
+
+def airquality(timestamp, r25, c25, r10, c10, profile=conversion.DEFAULT_PROFILE,
+               calibration25=None, calibration10=None):
+    """
+    Works out the PM counts, µg/m3 concentrations and US AQI
+    from the PM2.5 and PM1.0 ratios and concentrations read at
+    timestamp, with the particle sizes of profile, see
+    conversion.PROFILES, or the calibration.Calibration of
+    each channel if given, see conversion.reading_ugm3().
+
+    Returns the row logged for the readings, see csvlog.AIRQUALITY_HEADER.
+    """
+
+    # Special Calculations for differentiating between two particulate sizes
+    # Particle Size   0.5     0.8     1.0       1.5     2.4     2.5     2.6     3.0     3.5
+    # P2 (PM1.0) (c10 reading)        |--------------------------------------------------->
+    # P1 (PM2.5) (c25 reading)                                  |------------------------->
+    #
+    # In theory the counts for particles greater than 1.0 microns should be higher than
+    # particles greater than 2.5 microns.
+
+    # Note: To detect particles smaller than 2.5 and greater than 1.0
+    # Maybe hreshold input (IN1) is left unsed, but it will be used later as a way to
+    # split particule by size, and hence detect both PM1.0 and PM2.5 particules.
+    # Both counts use the concentrations for particles greater than 2.5,
+    # error readings and negative values are set to zero
+    PM25count, PM10count = conversion.counts(c25)
+
+    # Convert concentration of PM2.5 and PM1.0 particles per 0.01 cubic feet to µg/ metre cubed
+    # this method outlined by Drexel University students (2009) and is an approximation
+    # does not contain correction factors for humidity and rain, see conversion.py
+    # A calibration against a reference gives µg/ metre cubed from the ratio instead
+    concentration_ugm3_pm25, concentration_ugm3_pm10 = conversion.reading_ugm3(
+        r25, c25, r10, profile, calibration25, calibration10)
+
+    # Convert concentration of PM2.5 (ie. less than 2.5 microns) and PM10 (less than 10 microns)
+    # particles in µg/ metre cubed to the USA Environment Agency Air Quality Index - AQI, see aqi.py
+    # input should be 24 hour average of ugm3, not instantaneous reading
+    aqiPM25 = aqi.index(concentration_ugm3_pm25, aqi.PM25)
+    aqiPM10 = aqi.index(concentration_ugm3_pm10, aqi.PM10)
+
+    # Store values in a variable
+    return timestamp, r25, int(c25), r10, int(c10), int(PM25count), int(concentration_ugm3_pm25), int(PM10count), int(concentration_ugm3_pm10), int(aqiPM25), int(aqiPM10)
+
 
 if __name__ == "__main__":
 
@@ -105,48 +1180,111 @@ if __name__ == "__main__":
     import pidustsensor # import this script
     import sqlite3
     import sys
-
-    pi = pigpio.pi('localhost') # Connect to a remote pi or 'localhost'
+    import argparse
+    import os
+    import csvlog
+    import nowcast
+    import rollingstats
+    import scheduler
+    import signal
+
+    parser = argparse.ArgumentParser(description='Log PPD42NS dust sensor readings.')
+    parser.add_argument('--capture', metavar='FILE',
+                        help='append every raw sensor edge to this binary file')
+    parser.add_argument('--replay', metavar='FILE',
+                        help='replay edges from a --capture file instead of reading the Pi')
+    parser.add_argument('--csv', metavar='FILE', default='/media/pi/airqualitylog.csv',
+                        help='csv log file, appended to (default %(default)s)')
+    parser.add_argument('--csv-max-mb', type=float, metavar='MB',
+                        help='start a new csv log once it reaches this size')
+    parser.add_argument('--csv-rotate', type=float, metavar='HOURS',
+                        help='start a new csv log every this many hours, e.g. 24 for each UTC day')
+    parser.add_argument('--csv-gzip', action='store_true',
+                        help='gzip each csv log once a new one is started')
+    parser.add_argument('--csv-flush', type=int, default=csvlog.FLUSH_ROWS, metavar='ROWS',
+                        help='hand the csv log to the OS every this many rows (default %(default)s)')
+    parser.add_argument('--csv-fsync', type=float, default=csvlog.FSYNC_SECONDS, metavar='SECONDS',
+                        help='sync the csv log to the card at most every this many seconds (default %(default)s)')
+    parser.add_argument('--glitch', type=int, default=0, metavar='US',
+                        help='ignore pulses shorter than this many microseconds (default %(default)s)')
+    parser.add_argument('--latency', type=int, default=0, metavar='N',
+                        help='time the edge path, sampling the delay of every Nth edge')
+    parser.add_argument('--calibration', metavar='FILE',
+                        help='work out µg/m3 with the calibrations (gpio18 and gpio17) in this file')
+    parser.add_argument('--nowcast-dir', metavar='DIR',
+                        help='keep the NowCast hourly averages here across restarts')
+    args = parser.parse_args()
+
+    if args.replay:
+        # Replay a recording as fast as possible on a virtual clock
+        import replay
+        pi = replay.ReplayPi(pidustsensor.read_capture(args.replay))
+        schedule = scheduler.SampleScheduler(30, monotonic=pi.time, timer=pi.time, sleep=pi.sleep)
+    else:
+        pi = pigpio.pi('localhost') # Connect to a remote pi or 'localhost'
+        # Use 30 for a properly calibrated reading, samples land on :00 and :30
+        schedule = scheduler.SampleScheduler(30)
+
+    # Optionally use calibrations fitted by calibration.py
+    calibrations = {}
+    if args.calibration:
+        import calibration
+        calibrations = calibration.load(args.calibration)
+
+    # Optionally keep the raw edges of both channels for later reanalysis
+    capture = None
+    if args.capture:
+        capture = pidustsensor.EdgeCapture(spool=args.capture)
 
     # Select the pi GPIO pin that is connected to the sensor
     # For PM2.5 Readings, connected to Pin 4 of the Sensor
     # Make sure to use the Broadcom GPIO Pin number
-    s25 = pidustsensor.sensor(pi, 18)
+    s25 = pidustsensor.sensor(pi, 18, capture=capture, glitch=args.glitch, latency=args.latency)
 
     # Select the pi GPIO pin that is connected to the sensor
     # For PM1.0 Readings, connected to Pin 2 of the Sensor
     # Make sure to use the Broadcom GPIO Pin number
-    s10 = pidustsensor.sensor(pi, 17)
+    s10 = pidustsensor.sensor(pi, 17, capture=capture, glitch=args.glitch, latency=args.latency)
+
+    # NowCast and 24 hour averages for the AQI
+    path25 = path10 = None
+    if args.nowcast_dir:
+        path25 = os.path.join(args.nowcast_dir, 'nowcast_pm25.json')
+        path10 = os.path.join(args.nowcast_dir, 'nowcast_pm10.json')
+    nowcast25 = nowcast.NowCast(aqi.PM25, path25)
+    nowcast10 = nowcast.NowCast(aqi.PM10, path10)
+
+    # Rolling 1 min to 24 hour statistics of both concentrations
+    stats25 = rollingstats.RollingStats()
+    stats10 = rollingstats.RollingStats()
     
    
     # Option to prompt for filename:
     ##logfilename = input("Please enter a name for the logfile.") 
     ##with open(logfilename + '.csv', 'w', newline='') as f:
 
-    # Create a specific and static csv log file
-    with open('/media/pi/airqualitylog.csv', 'w', newline='') as f:
+    # Stop cleanly when the system shuts down, so the csv log is
+    # flushed and synced on the way out.
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    # Create a specific and static csv log file, appended to across
+    # restarts, see csvlog.py
+    with csvlog.CSVLog(args.csv, csvlog.AIRQUALITY_HEADER,
+                       max_bytes=int(args.csv_max_mb * 1000000) if args.csv_max_mb else None,
+                       rotate_seconds=args.csv_rotate * 3600 if args.csv_rotate else None,
+                       compress=args.csv_gzip, flush_rows=args.csv_flush,
+                       fsync_seconds=args.csv_fsync) as log:
     # Remove the above line if you want to use the prompt for logfile name function
-		
-        data_writer = writer(f)
-        #write header for csv log file
-        data_writer.writerow(['Date Time Stamp',
-                              'Ratio for PM2.5 (P2 or Pin4) (r25)',
-                              'Raw Readings of PM2.5 Concentration (PCS per 0.01 cubic foot) (c25)',
-                              'Ratio for PM1.0 (P1 or Pin2) (r10)',
-                              'Raw readings of PM1.0 Concentration (PCS  per 0.01 cubic foot) (c10)',
-                              'Concentration Count for Particles Greater than 1µg and Less than 2.5µ (PCS per 0.01 cubic foot) (PM25count = c10 - c25)',
-                              'SI PM2.5 Concentration (PCS per cubic metre) (concentration_ugm3_pm25)',
-                              'Concentration Count for Particles greater than 2.5 µg (PCS per 0.01 cubic foot) (PM10count = c25)',
-                              'SI PM10 Concentration (PCS per cubic metre)(concentration_ugm3_pm10)',
-                              'US AQI for PM2.5 (Should be average of a 24h reading)',
-                              'US AQI for PM10 (Should be average of a 24h reading)'])
 
-        while True:
+        while pi.connected:
         
-            time.sleep(30) # Use 30 for a properly calibrated reading.
+            deadline = schedule.wait()
 
-            # Get the current time of the reading
-            timestamp = datetime.now()
+            # The time of the reading is the deadline it was taken at
+            timestamp = datetime.fromtimestamp(deadline.time)
+
+            if deadline.missed:
+                print("Processing overran, skipped {} readings".format(deadline.missed))
 
             
             # Read the PM2.5 values from the sensor. Particles Greater than 2.5 micrometers.
@@ -165,6 +1303,19 @@ if __name__ == "__main__":
             # Read the PM1.0 values from the sensor. Particles Greater than 1 micrometers.
             # get the gpio, ratio and concentration in particles / 0.01 ft3
             g10, r10, c10 = s10.read()
+
+            # Spool the raw edges of this window
+            if capture is not None:
+                capture.flush()
+
+            # Report how long edges waited and took to handle
+            if args.latency:
+                for stats in (s25.read_latency(), s10.read_latency()):
+                    if not stats.edges:
+                        continue
+                    print("GPIO {} edges = {}, delay us min/p50/p99/max = {}/{}/{}/{}, "
+                          "exec us min/p50/p99/max = {:.1f}/{:.1f}/{:.1f}/{:.1f}".format(
+                              stats.gpio, stats.edges, *stats[3:]))
             
             # do some checks on the concentration reading and print errors
             # if (c10 == 1114000.62):
@@ -175,138 +1326,20 @@ if __name__ == "__main__":
             #    raise ValueError('Concentration cannot be a negative number')
 
 
-            # Special Calculations for differentiating between two particulate sizes
-            # Particle Size   0.5     0.8     1.0       1.5     2.4     2.5     2.6     3.0     3.5
-            # P2 (PM1.0) (c10 reading)        |--------------------------------------------------->
-            # P1 (PM2.5) (c25 reading)                                  |------------------------->
-            #
-            # In theory the counts for particles greater than 1.0 microns should be higher than
-            # particles greater than 2.5 microns.
-
-            # Note: To detect particles smaller than 2.5 and greater than 1.0
-            # Maybe hreshold input (IN1) is left unsed, but it will be used later as a way to
-            # split particule by size, and hence detect both PM1.0 and PM2.5 particules.
-            PM10count = c25         # Use the concentrations for particles greater than 2.5
-            # PM25count = c10 - c25   # Subtract Particle to get concentration of particles greater than 1 micron and less than 2.5 microns          
-            PM25count = c25
-            
-            if PM10count == 1114000.62:   #If PM10count gets error value set to zero
-                PM10count = 0
-                
-            if PM25count < 0:    # If PM25count is less than Zero (Negative Value) set PM25 Count to Zero
-                PM25count = 0
-
-            if PM25count == 1114000.62:   #If PM25count gets error value set to zero
-                PM25count = 0
-                
-
-            # Convert conentrations measured at µg/ft3 to µg/ metre cubed
-            # Convert concentration of PM2.5 and PM1.0 particles per 0.01 cubic feet to µg/ metre cubed
-            # this method outlined by Drexel University students (2009) and is an approximation
-            # does not contain correction factors for humidity and rain
-      
-            # Assume all particles are spherical, with a density of 1.65E12 µg/m3
-            density = 1.65 * math.pow(10, 12)
-        
-            # Convert concentration readings for particles greater than 1 micron and less than 2.5 microns
-            # Assume the radius of a particle in the PM2.5 channel is .44 µm
-            rpm25 = 0.44 * math.pow(10, -6)
-        
-            # Volume of a PM2.5 sphere = 4/3 * pi * radius^3
-            volpm25 = (4/3) * math.pi * (rpm25**3)
-        
-            # mass = density * volume
-            masspm25 = density * volpm25
-        
-            # parts/m3 =  parts/foot3 * 3531.5
-            # µg/m3 = parts/m3 * mass in µg
-            concentration_ugm3_pm25 = PM25count * 3531.5 * masspm25 # PM25count = c10 - c25
-
-            # Convert concentration readings for particles greater than 2.5 microns
-            ###OLD ### Assume the radius of a particle in the PM10 channel is 2.6 µm
-            ###OLD ### rpm10 = 2.6 * math.pow(10, -6)
-            # Assume the radius of a particle in the PM10 channel is .44 µm
-            rpm10 = 0.44 * math.pow(10, -6)
-        
-            # Volume of a PM10 sphere = 4/3 * pi * radius^3
-            volpm10 = (4/3) * math.pi * (rpm10**3)
-        
-            # mass = density * volume
-            masspm10 = density * volpm10
-        
-            # parts/m3 =  parts/foot3 * 3531.5
-            # µg/m3 = parts/m3 * mass in µg
-            concentration_ugm3_pm10 = PM10count * 3531.5 * masspm10 # Or use c25 instead of PM10count
+            # Work out the PM counts, concentrations and AQI from the readings
+            aqdata = pidustsensor.airquality(timestamp, r25, c25, r10, c10,
+                                             calibration25=calibrations.get('gpio18'),
+                                             calibration10=calibrations.get('gpio17'))
 
+            # Average the µg/m3 over hours for the AQI
+            ugm3_pm25, ugm3_pm10 = conversion.reading_ugm3(r25, c25, r10,
+                                                           calibration25=calibrations.get('gpio18'),
+                                                           calibration10=calibrations.get('gpio17'))
+            nowcast25.add(deadline.time, ugm3_pm25)
+            nowcast10.add(deadline.time, ugm3_pm10)
 
-
-      
-            # Convert concentration of PM2.5 (ie. less than 2.5 microns) particles in µg/ metre cubed to the USA 
-            # Environment Agency Air Quality Index - AQI
-            # https://en.wikipedia.org/wiki/Air_quality_index
-            # Computing_the_AQI
-            # https://github.com/intel-iot-devkit/upm/pull/409/commits/ad31559281bb5522511b26309a1ee73cd1fe208a?diff=split
-            # input should be 24 hour average of ugm3, not instantaneous reading
-      
-        
-            cbreakpointspm25 = [ [0.0, 12, 0, 50],\
-                            [12.1, 35.4, 51, 100],\
-                            [35.5, 55.4, 101, 150],\
-                            [55.5, 150.4, 151, 200],\
-                            [150.5, 250.4, 201, 300],\
-                            [250.5, 350.4, 301, 400],\
-                            [350.5, 500.4, 401, 500], ]
-                        
-            C = concentration_ugm3_pm25
-        
-            if C > 500.4:
-                aqiPM25 = 500
-
-            else:
-                for breakpoint in cbreakpointspm25:
-                    if breakpoint[0] <= C <= breakpoint[1]:
-                        Clow25 = breakpoint[0]
-                        Chigh25 = breakpoint[1]
-                        Ilow25 = breakpoint[2]
-                        Ihigh25 = breakpoint[3]
-                        aqiPM25 = (((Ihigh25-Ilow25)/(Chigh25-Clow25))*(C-Clow25))+Ilow25
-
-
-      
-            # Convert concentration of PM10 (less than 10 microns) particles in µg/ metre cubed to the USA 
-            # Environment Agency Air Quality Index - AQI
-            # https://en.wikipedia.org/wiki/Air_quality_index
-            # Computing_the_AQI
-            # https://github.com/intel-iot-devkit/upm/pull/409/commits/ad31559281bb5522511b26309a1ee73cd1fe208a?diff=split
-            # input should be 24 hour average of ugm3, not instantaneous reading
-      
-        
-            cbreakpointspm10 = [ [0, 54, 0, 50],\
-                            [55, 154, 51, 100],\
-                            [155, 254, 101, 150],\
-                            [255, 354, 151, 200],\
-                            [355, 424, 201, 300],\
-                            [425, 504, 301, 400],\
-                            [505, 604, 401, 500], ]
-                        
-            D = concentration_ugm3_pm10
-        
-            if D > 604:
-                aqiPM10 = 500
-
-            else:
-                for breakpoint in cbreakpointspm10:
-                    if breakpoint[0] <= D <= breakpoint[1]:
-                        Clow10 = breakpoint[0]
-                        Chigh10 = breakpoint[1]
-                        Ilow10 = breakpoint[2]
-                        Ihigh10 = breakpoint[3]
-                        aqiPM10 = (((Ihigh10-Ilow10)/(Chigh10-Clow10))*(D-Clow10))+Ilow10
-      
-
-         
-            # Store values in a variable
-            aqdata = timestamp, r25, int(c25), r10, int(c10), int(PM25count), int(concentration_ugm3_pm25), int(PM10count), int(concentration_ugm3_pm10), int(aqiPM25), int(aqiPM10)
+            stats25.add(deadline.time, c25)
+            stats10.add(deadline.time, c10)
          
             # SQLite3 Data Storage
             # Create a variable used to connect to the Database
@@ -315,18 +1348,23 @@ if __name__ == "__main__":
             # Insert the variables used in aqdata into the database
             #with con:
              #   curs = con.cursor() 
-              #  curs.execute("INSERT INTO airqualitylog(datetimestamp, r25_db, c25_db, r10_db, c10_db, PM25count_db, concentration_ugm3_pm25_db, PM10count_db, concentration_ugm3_pm10_db, aqiPM25_db, aqiPM10_db) VALUES(?,?,?,?,?,?,?,?,?,?,?)",(timestamp, r25, c25, r10, c10, PM25count, concentration_ugm3_pm25, PM10count, concentration_ugm3_pm10, aqiPM25, aqiPM10))  
+              #  curs.execute("INSERT INTO airqualitylog(datetimestamp, r25_db, c25_db, r10_db, c10_db, PM25count_db, concentration_ugm3_pm25_db, PM10count_db, concentration_ugm3_pm10_db, aqiPM25_db, aqiPM10_db) VALUES(?,?,?,?,?,?,?,?,?,?,?)", aqdata)  
 
             # commit the changes
            # con.commit()
             #con.close()
             
             # Store values in CSV log file
-            data_writer.writerow(aqdata) 
+            log.write(aqdata)
          
             # Print values to console
             print("Timestamp of Readings = {} \n PM2.5 (P2 or Pin4):  Ratio = {:.1f}, PM > 2.5 µg PCS Conc = {} µg/ft3 \n PM1.0 (P1 or Pin2):   Ratio = {:.1f}, PM > 1.0 µg PCS Conc = {} µg/ft3 \n Variables used for AQI (Particles 1.0 < 2.5 microns):   PM25count (P1 - P2) = {} µg/ft3, Metric Conc of PM25count = {} µg/m3, \n Variables used in AQI (Particles > 2.5 microns):         PM10count (P2 only) = {} µg/ft3, Metric Conc of PM10count= {} µg/m3 \n AQI Calculations (Needs to be average over 24hours): PM2.5 AQI = {}, PM10 AQI = {} \n " .
-                format(timestamp, r25, int(c25), r10, int(c10), int(PM25count), int(concentration_ugm3_pm25), int(PM10count), int(concentration_ugm3_pm10), int(aqiPM25), int(aqiPM10)))
+                format(*aqdata))
+            print(" NowCast AQI: PM2.5 = {}, PM10 = {}, 24 hour AQI: PM2.5 = {}, PM10 = {} \n ".format(
+                nowcast25.aqi(), nowcast10.aqi(), nowcast25.aqi24(), nowcast10.aqi24()))
+            for name, stats in (('PM2.5', stats25), ('PM1.0', stats10)):
+                print(" {} Conc mean (min-max) over 1m / 15m / 1h / 8h / 24h = {}".format(name, ' / '.join(
+                    "{:.0f} ({:.0f}-{:.0f})".format(s.mean, s.min, s.max) for s in stats.summaries())))
          
             # Print
             
@@ -0,0 +1,246 @@
+#!/usr/bin/env python
+
+# replay.py
+# GNU General Public License v3.0
+
+# Stand-in for pigpio.pi that replays recorded sensor edges, so the
+# pidustsensor.py pipeline can be run and benchmarked without a Pi.
+
+#############################################
+
+from __future__ import print_function
+import heapq
+import math
+import random
+import time
+from datetime import datetime
+
+import pigpio
+
+
+class _callback:
+    """
+    A registered edge callback, as returned by ReplayPi.callback().
+    """
+
+    def __init__(self, replay, gpio, edge, func):
+        self._replay = replay
+        self.gpio = gpio
+        self.edge = edge
+        self.func = func
+
+    def cancel(self):
+        """
+        Stops delivering edges to the callback.
+        """
+        callbacks = self._replay._callbacks.get(self.gpio, [])
+        if self in callbacks:
+            callbacks.remove(self)
+
+
+class ReplayPi:
+    """
+    A fake pigpio.pi which feeds a recorded edge stream to the
+    registered callbacks on a virtual clock.
+
+    Time only moves when sleep() is called, which delivers every
+    edge up to the new virtual time as fast as the callbacks can
+    take them. Use sleep(), time() and now() in place of
+    time.sleep(), time.time() and datetime.now() in the sampling
+    loop. Once the stream is exhausted connected becomes False.
+    """
+
+    def __init__(self, edges, start=None):
+        """
+        Instantiate with an iterable of (gpio, level, tick) edges
+        in tick order, e.g. from pidustsensor.read_capture() or
+        synthetic(), and the wall clock time the first edge is
+        taken to have happened at (default now).
+        """
+        self.connected = True
+
+        self._edges = iter(edges)
+        self._callbacks = {}
+        self._modes = {}
+
+        self._start = time.time() if start is None else start
+
+        # Virtual time is kept as an unwrapped 64 bit tick.
+        self._origin = None
+        self._now = None
+        self._last_tick = None
+        self._next = None
+
+        self._advance()
+        if self._next is not None:
+            self._origin = self._now = self._next[0]
+        else:
+            self._origin = self._now = 0
+            self.connected = False
+
+    def _advance(self):
+        """
+        Loads the next edge with its unwrapped tick into _next.
+        """
+        edge = next(self._edges, None)
+        if edge is None:
+            self._next = None
+            return
+
+        gpio, level, tick = edge
+
+        if self._last_tick is None:
+            extended = tick
+        else:
+            extended = self._next[0] + pigpio.tickDiff(self._last_tick, tick)
+
+        self._last_tick = tick
+        self._next = (extended, gpio, level, tick)
+
+    def set_mode(self, gpio, mode):
+        self._modes[gpio] = mode
+        return 0
+
+    def get_mode(self, gpio):
+        return self._modes.get(gpio, pigpio.INPUT)
+
+    def set_watchdog(self, user_gpio, wdog_timeout):
+        # Recordings already hold any timeouts seen when captured.
+        return 0
+
+    def callback(self, user_gpio, edge=pigpio.RISING_EDGE, func=None):
+        cb = _callback(self, user_gpio, edge, func)
+        self._callbacks.setdefault(user_gpio, []).append(cb)
+        return cb
+
+    def get_current_tick(self):
+        return self._now & 0xFFFFFFFF
+
+    def stop(self):
+        self.connected = False
+
+    def sleep(self, seconds):
+        """
+        Advances the virtual clock, delivering the edges passed.
+        """
+        # Always move on by at least a tick so a caller sleeping
+        # until a deadline cannot spin on rounding.
+        self._now = self._now + max(int(math.ceil(seconds * 1000000)), 1)
+
+        callbacks = self._callbacks
+        now = self._now
+
+        while self._next is not None and self._next[0] <= now:
+
+            extended, gpio, level, tick = self._next
+
+            for cb in callbacks.get(gpio, ()):
+                if cb.edge == pigpio.EITHER_EDGE or cb.edge != level:
+                    # RISING_EDGE is 0 and FALLING_EDGE is 1.
+                    cb.func(gpio, level, tick)
+
+            self._advance()
+
+        if self._next is None:
+            self.connected = False
+
+    def time(self):
+        """
+        Returns the virtual wall clock time in seconds.
+        """
+        return self._start + (self._now - self._origin) / 1000000.0
+
+    def now(self):
+        """
+        Returns the virtual wall clock time as a datetime.
+        """
+        return datetime.fromtimestamp(self.time())
+
+
+def synthetic(gpios, seconds, ratio=5.0, pulse=30000, seed=0):
+    """
+    Yields a random (gpio, level, tick) edge stream for each of
+    gpios, merged in tick order, covering the given number of
+    seconds.
+
+    Low pulses average pulse microseconds and take up about
+    ratio percent of the time, like a PPD42NS in moderate dust.
+    """
+    def channel(gpio, rng):
+        mean_high = pulse * (100.0 - ratio) / ratio
+        end = int(seconds * 1000000)
+        t = 0
+
+        while t < end:
+            t = t + int(rng.expovariate(1.0 / mean_high)) + 1
+            yield (t, gpio, 0)
+            t = t + int(rng.expovariate(1.0 / pulse)) + 1
+            yield (t, gpio, 1)
+
+    streams = [channel(gpio, random.Random(seed + gpio)) for gpio in gpios]
+
+    for t, gpio, level in heapq.merge(*streams):
+        yield (gpio, level, t & 0xFFFFFFFF)
+
+
+def benchmark(edges=200000, notify=False, repeat=3, **options):
+    """
+    Returns the best of repeat runs of the number of edges per
+    second one pidustsensor.sensor takes in, from a synthetic
+    stream fed straight to its callback, or with notify=True as
+    notification report blocks. Other keyword options are passed
+    to the sensor.
+    """
+    import pidustsensor
+
+    gpio = 18
+    stream = []
+    for g, level, tick in synthetic([gpio], edges * 0.0011, ratio=50.0, pulse=1000):
+        stream.append((g, level, tick))
+        if len(stream) == edges:
+            break
+
+    reports = None
+    if notify:
+        pack = pidustsensor.NOTIFY_REPORT.pack
+        data = b''.join(pack(0, 0, tick, level << gpio) for g, level, tick in stream)
+        reports = list(pidustsensor.NOTIFY_REPORT.iter_unpack(data))
+        block = pidustsensor.NOTIFY_BLOCK_REPORTS
+
+    best = 0.0
+
+    for run in range(repeat):
+        s = pidustsensor.sensor(ReplayPi([]), gpio, attach=False, **options)
+
+        start = time.perf_counter()
+
+        if notify:
+            ingest = s._ingest
+            for i in range(0, len(reports), block):
+                ingest(reports[i:i + block])
+        else:
+            cbf = s._cbf
+            for g, level, tick in stream:
+                cbf(g, level, tick)
+
+        best = max(best, len(stream) / (time.perf_counter() - start))
+
+    return best
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Measure pidustsensor edge throughput.')
+    parser.add_argument('--edges', type=int, default=200000,
+                        help='edges per run (default %(default)s)')
+    parser.add_argument('--notify', action='store_true',
+                        help='feed notification report blocks instead of callbacks')
+    parser.add_argument('--rolling', type=float,
+                        help='also keep a sliding window of this many seconds')
+    args = parser.parse_args()
+
+    rate = benchmark(args.edges, notify=args.notify, rolling=args.rolling)
+
+    print("{} edges per second through {}".format(int(rate), 'notify' if args.notify else 'callbacks'))
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+# reprocess.py
+# GNU General Public License v3.0
+
+# Regenerates the derived columns of old logs with the current
+# conversion formulas, e.g. after changing the particle size profile
+# or fitting a calibration.
+#
+# $ python3 reprocess.py airqualitylog.csv --output airqualitylog_new.csv
+# $ python3 reprocess.py envirosensorlog.csv --db reprocessed.db --table envirosensorlog
+#
+# An airqualitylog has its counts, µg/m3 and AQI recomputed from the
+# logged ratios. An envirosensorlog has its concentrations recomputed
+# and corrected for humidity, as the live loops log them, and the same
+# derived columns added. Logs are streamed in chunks so
+# memory use does not depend on their size.
+
+#############################################
+
+from __future__ import print_function
+import sqlite3
+from csv import writer
+
+import conversion
+import csvlog
+import humidity
+
+# Rows read and converted at a time
+CHUNK_ROWS = 65536
+
+AIRQUALITY = 'airquality'
+ENVIRONMENT = 'environment'
+
+# SQLite columns of each kind of log, see sqlite3schema.md and
+# sqlitesensorschema.md, the environment log gaining the derived
+# columns of the air quality log.
+AIRQUALITY_COLUMNS = ['datetimestamp', 'r25_db', 'c25_db', 'r10_db', 'c10_db',
+                      'PM25count_db', 'concentration_ugm3_pm25_db', 'PM10count_db',
+                      'concentration_ugm3_pm10_db', 'aqiPM25_db', 'aqiPM10_db']
+
+ENVIRONMENT_COLUMNS = ['datetimestamp', 'r25_db', 'c25_db', 'r10_db', 'c10_db',
+                       'temp_db', 'pres_db', 'hum_db', 'gas_db'] + AIRQUALITY_COLUMNS[5:]
+
+
+def kind_of(header):
+    """
+    Returns the kind of log with the csv header line given.
+    """
+    columns = len(header.split(','))
+
+    if columns == len(csvlog.AIRQUALITY_HEADER):
+        return AIRQUALITY
+
+    if columns == len(csvlog.ENVIRONMENT_HEADER):
+        return ENVIRONMENT
+
+    raise ValueError('not an air quality or environment log, {} columns'.format(columns))
+
+
+def convert_chunk(lines, kind, profile=conversion.DEFAULT_PROFILE, calibration25=None, calibration10=None,
+                  kappa=humidity.KAPPA, density=humidity.DENSITY, ceiling=humidity.MAX_HUMIDITY):
+    """
+    Returns the rows of a list of csv log lines with the derived
+    columns recomputed, as a list of tuples. The concentrations of
+    an environment log are corrected for humidity with kappa,
+    density and ceiling, see humidity.correct().
+    """
+    import numpy as np
+
+    if kind == AIRQUALITY:
+        data = np.loadtxt(lines, delimiter=',', usecols=(0, 1, 3), ndmin=1,
+                          dtype=[('time', 'U32'), ('r25', 'f8'), ('r10', 'f8')])
+    else:
+        data = np.loadtxt(lines, delimiter=',', usecols=(0, 1, 3, 5, 6, 7, 8), ndmin=1,
+                          dtype=[('time', 'U32'), ('r25', 'f8'), ('r10', 'f8'), ('temp', 'f8'),
+                                 ('pres', 'f8'), ('hum', 'f8'), ('gas', 'f8')])
+
+    dry = None
+    if kind == ENVIRONMENT:
+        dry = humidity.correct_array(1.0, data['hum'], kappa, density, ceiling)
+
+    v = conversion.convert(data['r25'], data['r10'], profile, calibration25, calibration10, dry)
+
+    # Whole numbers as logged by airquality()
+    def whole(a):
+        return a.astype(np.int64).tolist()
+
+    derived = [whole(v.pm25count), whole(v.ugm3_pm25), whole(v.pm10count), whole(v.ugm3_pm10),
+               whole(v.aqi_pm25), whole(v.aqi_pm10)]
+
+    columns = [data['time'].tolist(), data['r25'].tolist(), whole(v.c25), data['r10'].tolist(), whole(v.c10)]
+
+    if kind == ENVIRONMENT:
+        columns.extend(data[name].tolist() for name in ('temp', 'pres', 'hum', 'gas'))
+
+    return list(zip(*(columns + derived)))
+
+
+def reprocess(source, output=None, db=None, table=None, profile=conversion.DEFAULT_PROFILE,
+              calibration25=None, calibration10=None, kappa=humidity.KAPPA, density=humidity.DENSITY,
+              ceiling=humidity.MAX_HUMIDITY, chunk=CHUNK_ROWS):
+    """
+    Streams the csv log source chunk rows at a time, writing each
+    row with its derived columns recomputed to the csv output
+    and or the table of the SQLite database db (created if need
+    be), see convert_chunk(). Damaged rows, e.g. cut short by a
+    power cut, are skipped, see csvlog.read_chunks().
+
+    Returns the number of rows written and the number skipped.
+    """
+    rows = 0
+    skipped = 0
+
+    with open(source, newline='') as f:
+
+        header = next(f, None)
+        if header is None:
+            return 0, 0
+
+        kind = kind_of(header)
+
+        out = data_writer = con = None
+
+        try:
+            if output is not None:
+                out = open(output, 'w', newline='')
+                data_writer = writer(out)
+
+                if kind == AIRQUALITY:
+                    data_writer.writerow(csvlog.AIRQUALITY_HEADER)
+                else:
+                    data_writer.writerow(csvlog.ENVIRONMENT_HEADER + csvlog.AIRQUALITY_HEADER[5:])
+
+            if db is not None:
+                columns = AIRQUALITY_COLUMNS if kind == AIRQUALITY else ENVIRONMENT_COLUMNS
+                table = table or ('airqualitylog' if kind == AIRQUALITY else 'envirosensorlog')
+
+                con = sqlite3.connect(db)
+                con.execute('CREATE TABLE IF NOT EXISTS {} ({} text NOT NULL, {})'.format(
+                    table, columns[0], ', '.join('{} integer NOT NULL'.format(c) for c in columns[1:])))
+                insert = 'INSERT INTO {}({}) VALUES({})'.format(
+                    table, ', '.join(columns), ','.join('?' * len(columns)))
+
+            def convert(lines):
+                return convert_chunk(lines, kind, profile, calibration25, calibration10,
+                                     kappa, density, ceiling)
+
+            for lines, converted, left_out in csvlog.read_chunks(f, header, convert, chunk):
+                skipped = skipped + left_out
+                if not lines:
+                    continue
+
+                if data_writer is not None:
+                    data_writer.writerows(converted)
+
+                if con is not None:
+                    with con:
+                        con.executemany(insert, converted)
+
+                rows = rows + len(converted)
+
+        finally:
+            if out is not None:
+                out.close()
+            if con is not None:
+                con.close()
+
+    return rows, skipped
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Recompute the derived columns of a dust sensor log.')
+    parser.add_argument('source', help='airqualitylog.csv or envirosensorlog.csv')
+    parser.add_argument('--output', metavar='FILE',
+                        help='csv file to write')
+    parser.add_argument('--db', metavar='FILE',
+                        help='SQLite database to write')
+    parser.add_argument('--table',
+                        help='table to write (default airqualitylog or envirosensorlog)')
+    parser.add_argument('--profile', default=conversion.DEFAULT_PROFILE.name,
+                        choices=sorted(conversion.PROFILES),
+                        help='particle size profile (default %(default)s)')
+    parser.add_argument('--calibration', metavar='FILE',
+                        help='work out µg/m3 with the gpio18 and gpio17 calibrations in this file')
+    parser.add_argument('--kappa', type=float, default=humidity.KAPPA,
+                        help='particle hygroscopicity, environment logs (default %(default)s)')
+    parser.add_argument('--density', type=float, default=humidity.DENSITY,
+                        help='dry particle density in g/cm3, environment logs (default %(default)s)')
+    parser.add_argument('--max-humidity', type=float, default=humidity.MAX_HUMIDITY,
+                        help='cap the humidity correction at this %%RH, 0 for none (default %(default)s)')
+    args = parser.parse_args()
+
+    if args.output is None and args.db is None:
+        parser.error('give --output and or --db')
+
+    calibrations = {}
+    if args.calibration:
+        import calibration
+        calibrations = calibration.load(args.calibration)
+
+    rows, skipped = reprocess(args.source, args.output, args.db, args.table, args.profile,
+                              calibrations.get('gpio18'), calibrations.get('gpio17'),
+                              args.kappa, args.density, args.max_humidity)
+
+    print("Reprocessed {} rows, skipped {} malformed rows".format(rows, skipped))
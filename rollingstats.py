@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+
+# rollingstats.py
+# GNU General Public License v3.0
+
+# Rolling mean, min and max of the sensor readings over several time
+# horizons at once, in a fixed amount of memory.
+
+#############################################
+
+from __future__ import print_function
+from array import array
+from collections import namedtuple
+
+# Default horizons in seconds, 1 min, 15 min, 1 h, 8 h and 24 h.
+HORIZONS = (60, 900, 3600, 28800, 86400)
+
+# Buckets each horizon is split into.
+BUCKETS = 60
+
+# The statistics of one horizon as returned by RollingStats.summary(),
+# mean, min and max are None without any readings.
+Summary = namedtuple('Summary', 'seconds count mean min max')
+
+
+class Horizon:
+    """
+    The readings of the last seconds seconds, kept as count, sum,
+    min and max in a ring of buckets indexed by bucket number.
+
+    A slot remembers the bucket it holds, so a slot left over
+    from a bucket outside the horizon is simply skipped and is
+    only cleared when it is reused. The horizon therefore ends
+    within a bucket width of seconds ago.
+    """
+
+    def __init__(self, seconds, buckets=BUCKETS):
+        self.seconds = seconds
+
+        self._width = float(seconds) / buckets
+        self._stamps = array('q', [-1]) * buckets
+        self._counts = array('L', [0]) * buckets
+        self._sums = array('d', [0.0]) * buckets
+        self._mins = array('d', [0.0]) * buckets
+        self._maxs = array('d', [0.0]) * buckets
+
+        # Bucket of the latest reading.
+        self._latest = None
+
+    def add(self, timestamp, value):
+        """
+        Adds a reading taken at timestamp seconds.
+        """
+        bucket = int(timestamp // self._width)
+        i = bucket % len(self._stamps)
+
+        if self._stamps[i] != bucket:
+            self._stamps[i] = bucket
+            self._counts[i] = 1
+            self._sums[i] = value
+            self._mins[i] = value
+            self._maxs[i] = value
+
+        else:
+            self._counts[i] += 1
+            self._sums[i] += value
+            if value < self._mins[i]:
+                self._mins[i] = value
+            if value > self._maxs[i]:
+                self._maxs[i] = value
+
+        if self._latest is None or bucket > self._latest:
+            self._latest = bucket
+
+    def summary(self):
+        """
+        Returns a Summary of the readings in the horizon up to the
+        latest one.
+        """
+        count = 0
+        total = 0.0
+        lowest = highest = None
+
+        if self._latest is not None:
+            oldest = self._latest - len(self._stamps) + 1
+
+            for i, stamp in enumerate(self._stamps):
+                if stamp < oldest:
+                    continue
+
+                count = count + self._counts[i]
+                total = total + self._sums[i]
+
+                if lowest is None or self._mins[i] < lowest:
+                    lowest = self._mins[i]
+                if highest is None or self._maxs[i] > highest:
+                    highest = self._maxs[i]
+
+        mean = total / count if count else None
+
+        return Summary(self.seconds, count, mean, lowest, highest)
+
+
+class RollingStats:
+    """
+    Keeps the mean, min and max of a series of readings, e.g. the
+    concentration from each sensor.read(), over each of several
+    horizons. Memory use is fixed by the number of horizons and
+    buckets, adding a reading costs the same however many have
+    been added and a summary only looks at the buckets.
+    """
+
+    def __init__(self, horizons=HORIZONS, buckets=BUCKETS):
+        """
+        Instantiate with the horizons in seconds and the number of
+        buckets to split each into.
+        """
+        self._horizons = [Horizon(seconds, buckets) for seconds in horizons]
+
+    def add(self, timestamp, value):
+        """
+        Adds a reading taken at timestamp, in seconds.
+        """
+        for horizon in self._horizons:
+            horizon.add(timestamp, value)
+
+    def summary(self, seconds):
+        """
+        Returns the Summary of the horizon of seconds.
+        """
+        for horizon in self._horizons:
+            if horizon.seconds == seconds:
+                return horizon.summary()
+
+        raise KeyError(seconds)
+
+    def summaries(self):
+        """
+        Returns a list of Summary tuples, one per horizon in order.
+        """
+        return [horizon.summary() for horizon in self._horizons]
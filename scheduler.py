@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+# scheduler.py
+# GNU General Public License v3.0
+
+# Drift free sampling schedule for the sensor loops.
+
+#############################################
+
+from __future__ import print_function
+import math
+import time
+from collections import namedtuple
+
+# What SampleScheduler.wait() returns: the wall clock time of the
+# deadline in seconds, how many seconds late the wait returned, and
+# how many deadlines were missed since the previous one.
+Deadline = namedtuple('Deadline', 'time late missed')
+
+SKIP = 'skip'
+COALESCE = 'coalesce'
+
+
+class SampleScheduler:
+    """
+    Fires on absolute deadlines that fall on whole multiples of
+    period seconds of wall clock time, e.g. :00 and :30 for a 30
+    second period, so samples from different stations line up.
+
+    Waiting is done against the monotonic clock, so time spent
+    processing a sample does not push the next one back and the
+    schedule does not drift. The wall clock is only used to find
+    the boundaries, which are recomputed if it is stepped.
+
+    When processing overruns one or more deadlines the policy
+    decides what happens: SKIP waits for the next boundary still
+    ahead, COALESCE fires at once for the latest missed one.
+    Either way the missed count is reported.
+    """
+
+    def __init__(self, period=30, policy=SKIP,
+                 monotonic=time.monotonic, timer=time.time, sleep=time.sleep):
+        """
+        Instantiate with the period in seconds, the overrun policy,
+        and optionally the clocks and sleep to use (e.g. a replay's
+        virtual clock).
+        """
+        if policy not in (SKIP, COALESCE):
+            raise ValueError('unknown overrun policy {!r}'.format(policy))
+
+        self.period = period
+        self.policy = policy
+
+        self._monotonic = monotonic
+        self._timer = timer
+        self._sleep = sleep
+
+        # Number of deadlines missed so far.
+        self.overruns = 0
+
+        self._next = self._boundary_after(timer())
+
+    def _boundary_after(self, wall):
+        """
+        Returns the first wall clock boundary after wall.
+        """
+        return (math.floor(wall / self.period) + 1) * self.period
+
+    def wait(self):
+        """
+        Sleeps until the next deadline and returns a Deadline.
+        """
+        period = self.period
+        deadline = self._next
+
+        # Where the deadline falls on the monotonic clock.
+        offset = self._timer() - self._monotonic()
+        remaining = deadline - offset - self._monotonic()
+
+        if remaining > 2 * period:
+            # The wall clock was stepped back, realign to it.
+            deadline = self._boundary_after(self._timer())
+            remaining = deadline - offset - self._monotonic()
+
+        missed = 0
+
+        if remaining < -period:
+            # Overran by at least one whole period, later deadlines
+            # have passed too.
+            passed = int(-remaining // period)
+
+            if self.policy == SKIP:
+                # Drop every deadline passed, wait for the next.
+                missed = passed + 1
+            else:
+                # Fire now for the latest deadline passed.
+                missed = passed
+
+            deadline = deadline + missed * period
+            remaining = remaining + missed * period
+
+            self.overruns = self.overruns + missed
+
+        target = deadline - offset
+
+        while remaining > 0:
+            self._sleep(remaining)
+            remaining = target - self._monotonic()
+
+        self._next = deadline + period
+
+        late = -remaining if remaining < 0 else 0.0
+
+        return Deadline(deadline, late, missed)
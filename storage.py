@@ -0,0 +1,793 @@
+#!/usr/bin/env python
+
+# storage.py
+# GNU General Public License v3.0
+
+# SQLite storage of the sensor readings, see sqlite3schema.md.
+#
+# $ python3 storage.py migrate airqualitylog.db airqualitylog.db
+# copies the readings of a database created with the older text time
+# stamp schema into the current tables.
+#
+# Alongside each table minute, hour and day rollups are kept, e.g.
+# airquality_1h, holding the count, sum, min and max of every value,
+# so charts over long periods read a row per bucket instead of every
+# reading.
+#
+# $ python3 storage.py rollup airqualitylog.db
+# rebuilds them from the readings, or given a directory of monthly
+# files (see below) those of the months still kept.
+#
+# The readings can instead be stored in a database file per month, see
+# PartitionedWriter, with old months dropped by expire and closed ones
+# compacted by compact, e.g. from cron
+# $ python3 storage.py expire /media/pi/airquality --days 365
+# $ python3 storage.py compact /media/pi/airquality
+
+#############################################
+
+from __future__ import print_function
+import os
+import sqlite3
+import time
+from datetime import datetime, timezone
+
+# Tables of sqlite3schema.md and sqlitesensorschema.md. Readings are
+# keyed on the sensor id and the time in milliseconds since the epoch,
+# the tables being stored in that order (WITHOUT ROWID) so the readings
+# of a sensor over a time range are one seek and a sequential scan.
+AIRQUALITY_SCHEMA = ("CREATE TABLE IF NOT EXISTS airquality (sensor integer NOT NULL, "
+                     "time_ms integer NOT NULL, r25 real NOT NULL, c25 real NOT NULL, "
+                     "r10 real NOT NULL, c10 real NOT NULL, pm25count real, ugm3_pm25 real, "
+                     "pm10count real, ugm3_pm10 real, aqi_pm25 integer, aqi_pm10 integer, "
+                     "PRIMARY KEY (sensor, time_ms)) WITHOUT ROWID")
+
+ENVIRONMENT_SCHEMA = ("CREATE TABLE IF NOT EXISTS environment (sensor integer NOT NULL, "
+                      "time_ms integer NOT NULL, r25 real NOT NULL, c25 real NOT NULL, "
+                      "r10 real NOT NULL, c10 real NOT NULL, temp real, pres real, hum real, gas real, "
+                      "PRIMARY KEY (sensor, time_ms)) WITHOUT ROWID")
+
+# A reading logged twice, e.g. around a restart, replaces the first.
+AIRQUALITY_INSERT = ("INSERT OR REPLACE INTO airquality(sensor, time_ms, r25, c25, r10, c10, "
+                     "pm25count, ugm3_pm25, pm10count, ugm3_pm10, aqi_pm25, aqi_pm10) "
+                     "VALUES(?,?,?,?,?,?,?,?,?,?,?,?)")
+
+ENVIRONMENT_INSERT = ("INSERT OR REPLACE INTO environment(sensor, time_ms, r25, c25, r10, c10, "
+                      "temp, pres, hum, gas) VALUES(?,?,?,?,?,?,?,?,?,?)")
+
+# Sensor id of a single station
+SENSOR = 0
+
+# The tables of older databases, with a text time stamp and no key, and
+# the columns migrate() copies from each into the current tables.
+LEGACY_TABLES = [
+    ('airqualitylog', 'airquality', AIRQUALITY_SCHEMA, AIRQUALITY_INSERT,
+     ['datetimestamp', 'r25_db', 'c25_db', 'r10_db', 'c10_db', 'PM25count_db',
+      'concentration_ugm3_pm25_db', 'PM10count_db', 'concentration_ugm3_pm10_db',
+      'aqiPM25_db', 'aqiPM10_db']),
+    ('envirosensorlog', 'environment', ENVIRONMENT_SCHEMA, ENVIRONMENT_INSERT,
+     ['datetimestamp', 'r25_db', 'c25_db', 'r10_db', 'c10_db', 'temp_db', 'pres_db',
+      'hum_db', 'gas_db']),
+]
+
+TABLES = [table for legacy, table, schema, insert, columns in LEGACY_TABLES]
+
+SCHEMAS = dict((table, schema) for legacy, table, schema, insert, columns in LEGACY_TABLES)
+INSERTS = dict((table, insert) for legacy, table, schema, insert, columns in LEGACY_TABLES)
+
+# Rows copied per transaction by migrate()
+MIGRATE_ROWS = 10000
+
+# Values of each table, after the sensor id and time
+COLUMNS = {
+    'airquality': ['r25', 'c25', 'r10', 'c10', 'pm25count', 'ugm3_pm25', 'pm10count', 'ugm3_pm10',
+                   'aqi_pm25', 'aqi_pm10'],
+    'environment': ['r25', 'c25', 'r10', 'c10', 'temp', 'pres', 'hum', 'gas'],
+}
+
+# Rollups kept of each table, as the suffix of their table and the width
+# of their buckets in milliseconds. Buckets start on whole minutes, hours
+# and UTC days.
+ROLLUPS = [('1m', 60000), ('1h', 3600000), ('1d', 86400000)]
+
+ROLLUP_TABLES = ['{}_{}'.format(table, suffix) for table in TABLES for suffix, width in ROLLUPS]
+
+# The partitions of a partitioned table, see PartitionedWriter, kept in
+# its catalog database alongside the rollups.
+CATALOG_SCHEMA = ("CREATE TABLE IF NOT EXISTS partitions (name text NOT NULL PRIMARY KEY, "
+                  "start_ms integer NOT NULL, end_ms integer NOT NULL, "
+                  "compacted integer NOT NULL DEFAULT 0)")
+
+# Milliseconds after its month ends before a partition is compacted,
+# by when the writer has moved on to the next.
+COMPACT_AFTER = 86400000
+
+# Default batching, rows are committed once this many are waiting or
+# the oldest has waited this many seconds.
+BATCH_ROWS = 20
+BATCH_SECONDS = 300
+
+
+class SQLiteWriter:
+    """
+    Appends rows to a SQLite table over one long lived connection.
+
+    The database is put in WAL mode, where a commit appends to the
+    write ahead log instead of rewriting pages of the database, and
+    rows are buffered and committed batch rows at a time. A row
+    waits at most max_age seconds before it is committed, as long
+    as rows keep coming, and every commit is synced to the card,
+    which bounds how much a power cut can lose. close() commits
+    whatever is waiting.
+    """
+
+    def __init__(self, path, insert, schema=None, batch=BATCH_ROWS, max_age=BATCH_SECONDS,
+                 monotonic=time.monotonic, rollup=None):
+        """
+        Instantiate with the database file, the INSERT statement
+        rows are written with and optionally the CREATE TABLE
+        statement of its table. Given the name of one of TABLES as
+        rollup, the rollups of that table are brought up to date in
+        the same transaction as each batch, see update_rollups().
+        """
+        self.insert = insert
+        self.rollup = rollup
+        self.batch = batch
+        self.max_age = max_age
+
+        self._monotonic = monotonic
+        self._rows = []
+        self._oldest = None
+
+        self.con = sqlite3.connect(path, check_same_thread=False)
+        self.con.execute('PRAGMA journal_mode=WAL')
+
+        # Sync the log on every commit. NORMAL would only sync at
+        # checkpoints, so a power cut could lose batches committed
+        # long before; batching keeps the syncs few.
+        self.con.execute('PRAGMA synchronous=FULL')
+
+        if schema is not None:
+            with self.con:
+                self.con.execute(schema)
+
+        if rollup is not None:
+            with self.con:
+                for suffix, width in ROLLUPS:
+                    self.con.execute(rollup_schema(rollup, suffix))
+
+    def write(self, row):
+        """
+        Buffers row, committing the batch if it is due.
+        """
+        if not self._rows:
+            self._oldest = self._monotonic()
+
+        self._rows.append(row)
+
+        if len(self._rows) >= self.batch or self._monotonic() - self._oldest >= self.max_age:
+            self.flush()
+
+    def flush(self):
+        """
+        Commits every buffered row in one transaction.
+        """
+        if not self._rows:
+            return
+
+        with self.con:
+            if self.rollup is not None:
+                replaced = replaced_keys(self.con, self.rollup, self._rows)
+
+            self.con.executemany(self.insert, self._rows)
+
+            if self.rollup is not None:
+                update_rollups(self.con, self.rollup, self._rows, replaced)
+
+        self._rows = []
+        self._oldest = None
+
+    def close(self):
+        """
+        Commits any buffered rows and closes the database.
+        """
+        try:
+            self.flush()
+        finally:
+            self.con.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class PartitionedWriter(SQLiteWriter):
+    """
+    As SQLiteWriter, storing the readings of table in a database
+    file per UTC month in directory, e.g. airquality-2019-06.db.
+    The rollups of the table and a catalog of its partitions are
+    kept in the catalog database, e.g. airquality.db, so old
+    months can be dropped by deleting their file without losing
+    the rollups, see expire(), and closed months compacted while
+    the writer carries on, see compact(). query() reads across
+    the partitions.
+
+    The partition of the month being written is attached to the
+    catalog database, so a batch and its rollups are committed
+    together.
+    """
+
+    def __init__(self, directory, table, batch=BATCH_ROWS, max_age=BATCH_SECONDS, keep_days=None,
+                 monotonic=time.monotonic):
+        """
+        Instantiate with the directory of the partitions and the
+        name of one of TABLES. Given keep_days, partitions whose
+        month ended more than that many days ago are dropped as
+        each new month starts.
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self.directory = directory
+        self.table = table
+        self.keep_days = keep_days
+        self._month = None
+
+        SQLiteWriter.__init__(self, catalog_path(directory, table), INSERTS[table], CATALOG_SCHEMA,
+                              batch, max_age, monotonic, rollup=table)
+
+    def flush(self):
+        """
+        Commits every buffered row in one transaction per month.
+        """
+        if not self._rows:
+            return
+
+        months = {}
+        for row in self._rows:
+            months.setdefault(month_of(row[1]), []).append(row)
+
+        for month in sorted(months):
+            self._attach(month)
+
+            # The catalog database has no table of readings, so
+            # the insert goes to the one in the partition.
+            with self.con:
+                replaced = replaced_keys(self.con, self.table, months[month])
+                self.con.executemany(self.insert, months[month])
+                update_rollups(self.con, self.table, months[month], replaced)
+
+        self._rows = []
+        self._oldest = None
+
+    def _attach(self, month):
+        """
+        Attaches the partition of month, creating it if need be.
+        """
+        if month == self._month:
+            return
+
+        name = partition_name(self.table, month)
+        path = os.path.join(self.directory, name + '.db')
+
+        part = sqlite3.connect(path)
+        try:
+            part.execute('PRAGMA journal_mode=WAL')
+            with part:
+                part.execute(SCHEMAS[self.table])
+        finally:
+            part.close()
+
+        if self._month is not None:
+            self.con.execute('DETACH DATABASE part')
+
+        self.con.execute('ATTACH DATABASE ? AS part', (path,))
+        self.con.execute('PRAGMA part.synchronous=FULL')
+
+        start, end = month_range(month)
+        with self.con:
+            self.con.execute('INSERT OR IGNORE INTO partitions(name, start_ms, end_ms) VALUES(?,?,?)',
+                             (name, start, end))
+
+        self._month = month
+
+        if self.keep_days is not None:
+            expire(self.directory, self.table, self.keep_days)
+
+
+def epoch_ms(timestamp):
+    """
+    Returns the milliseconds since the epoch of timestamp, a
+    datetime (local time if naive, as logged), its ISO text form
+    as in older databases, or seconds as from time.time().
+    """
+    if isinstance(timestamp, str):
+        timestamp = datetime.fromisoformat(timestamp)
+
+    if isinstance(timestamp, datetime):
+        timestamp = timestamp.timestamp()
+
+    return int(round(timestamp * 1000))
+
+
+def record(row, sensor=SENSOR):
+    """
+    Returns the database row of a log row, a time stamp followed by
+    the values in the column order of the csv logs.
+    """
+    return (sensor, epoch_ms(row[0])) + tuple(row[1:])
+
+
+def readings(con, table, start, end, sensor=SENSOR):
+    """
+    Returns a cursor over the rows of table for sensor from start
+    up to end, each in any form epoch_ms() takes, in time order.
+    table may also be a rollup, e.g. airquality_1h, whose rows are
+    those of the buckets starting in the range.
+    """
+    if table not in TABLES and table not in ROLLUP_TABLES:
+        raise ValueError('no table {}'.format(table))
+
+    return con.execute('SELECT * FROM {} WHERE sensor = ? AND time_ms >= ? AND time_ms < ? '
+                       'ORDER BY time_ms'.format(table), (sensor, epoch_ms(start), epoch_ms(end)))
+
+
+def rollup_schema(table, suffix):
+    """
+    Returns the CREATE TABLE statement of the rollup of table with
+    suffix, see ROLLUPS. Each row is the bucket starting at time_ms
+    with the number of readings in it and the sum, min and max of
+    each of the values.
+    """
+    values = ', '.join('{0}_sum real, {0}_min real, {0}_max real'.format(c) for c in COLUMNS[table])
+
+    return ('CREATE TABLE IF NOT EXISTS {}_{} (sensor integer NOT NULL, time_ms integer NOT NULL, '
+            'count integer NOT NULL, {}, PRIMARY KEY (sensor, time_ms)) WITHOUT ROWID'.format(
+                table, suffix, values))
+
+
+def _rollup_upsert(table, suffix):
+    """
+    Returns the statement adding a partial bucket to the rollup of
+    table with suffix, merging it with the bucket if already there.
+    """
+    columns = COLUMNS[table]
+    names = ['{}_{}'.format(c, stat) for c in columns for stat in ('sum', 'min', 'max')]
+
+    # A NULL sum, min or max is of a bucket without that value,
+    # merging with it leaves the other side.
+    merge = []
+    for c in columns:
+        merge.append('{0}_sum = coalesce({0}_sum + excluded.{0}_sum, {0}_sum, excluded.{0}_sum)'.format(c))
+        merge.append('{0}_min = coalesce(min({0}_min, excluded.{0}_min), {0}_min, excluded.{0}_min)'.format(c))
+        merge.append('{0}_max = coalesce(max({0}_max, excluded.{0}_max), {0}_max, excluded.{0}_max)'.format(c))
+
+    return ('INSERT INTO {}_{}(sensor, time_ms, count, {}) VALUES({}) '
+            'ON CONFLICT(sensor, time_ms) DO UPDATE SET count = count + excluded.count, {}'.format(
+                table, suffix, ', '.join(names), ','.join('?' * (len(names) + 3)), ', '.join(merge)))
+
+
+def aggregate(rows, width):
+    """
+    Returns the rollup rows of the database rows given, one per
+    sensor and bucket of width milliseconds they fall in.
+    """
+    buckets = {}
+
+    for row in rows:
+        key = (row[0], row[1] // width * width)
+        bucket = buckets.get(key)
+
+        if bucket is None:
+            bucket = buckets[key] = [0] + [None] * (3 * (len(row) - 2))
+
+        bucket[0] += 1
+
+        i = 1
+        for value in row[2:]:
+            if value is not None:
+                if bucket[i] is None:
+                    bucket[i] = bucket[i + 1] = bucket[i + 2] = value
+                else:
+                    bucket[i] += value
+                    if value < bucket[i + 1]:
+                        bucket[i + 1] = value
+                    if value > bucket[i + 2]:
+                        bucket[i + 2] = value
+            i = i + 3
+
+    return [key + tuple(bucket) for key, bucket in buckets.items()]
+
+
+def replaced_keys(con, table, rows):
+    """
+    Returns the (sensor, time_ms) keys of the database rows given
+    which replace a row when inserted into table, one already
+    stored or earlier in rows.
+    """
+    select = 'SELECT 1 FROM {} WHERE sensor = ? AND time_ms = ?'.format(table)
+
+    seen = set()
+    replaced = []
+
+    for row in rows:
+        key = (row[0], row[1])
+        if key in seen or con.execute(select, key).fetchone() is not None:
+            replaced.append(key)
+        seen.add(key)
+
+    return replaced
+
+
+def update_rollups(con, table, rows, replaced=()):
+    """
+    Adds the database rows given, just inserted into table, to each
+    of its rollups. The buckets of the keys replaced, see
+    replaced_keys(), are instead recomputed from table, as what the
+    replaced rows added to them cannot be taken back out.
+    """
+    values = ', '.join('sum({0}), min({0}), max({0})'.format(c) for c in COLUMNS[table])
+
+    for suffix, width in ROLLUPS:
+        stale = set((sensor, time_ms // width * width) for sensor, time_ms in replaced)
+        fresh = [row for row in rows if (row[0], row[1] // width * width) not in stale]
+
+        con.executemany(_rollup_upsert(table, suffix), aggregate(fresh, width))
+
+        for sensor, start in stale:
+            con.execute('DELETE FROM {}_{} WHERE sensor = ? AND time_ms = ?'.format(table, suffix),
+                        (sensor, start))
+            con.execute('INSERT INTO {0}_{1} SELECT sensor, ?, count(*), {2} FROM {0} '
+                        'WHERE sensor = ? AND time_ms >= ? AND time_ms < ? GROUP BY sensor'.format(
+                            table, suffix, values), (start, sensor, start, start + width))
+
+
+def rebuild_rollups(con, table):
+    """
+    Recomputes every rollup of table from its rows, in one
+    transaction. Returns the number of hourly buckets.
+    """
+    values = ', '.join('sum({0}), min({0}), max({0})'.format(c) for c in COLUMNS[table])
+
+    with con:
+        for suffix, width in ROLLUPS:
+            con.execute(rollup_schema(table, suffix))
+            con.execute('DELETE FROM {}_{}'.format(table, suffix))
+            con.execute('INSERT INTO {0}_{1} SELECT sensor, time_ms / {2} * {2}, count(*), {3} FROM {0} '
+                        'GROUP BY sensor, time_ms / {2}'.format(table, suffix, width, values))
+
+    return con.execute('SELECT count(*) FROM {}_1h'.format(table)).fetchone()[0]
+
+
+def rebuild_partitioned_rollups(directory, table):
+    """
+    As rebuild_rollups() for the table partitioned in directory by
+    a PartitionedWriter, one partition per transaction. Only the
+    buckets of months still partitioned are recomputed, those of
+    expired months are kept. Returns the number of hourly buckets.
+    """
+    values = ', '.join('sum({0}), min({0}), max({0})'.format(c) for c in COLUMNS[table])
+
+    catalog = sqlite3.connect(catalog_path(directory, table))
+    try:
+        with catalog:
+            catalog.execute(CATALOG_SCHEMA)
+            for suffix, width in ROLLUPS:
+                catalog.execute(rollup_schema(table, suffix))
+
+        months = catalog.execute('SELECT name, start_ms, end_ms FROM partitions ORDER BY start_ms').fetchall()
+
+        for name, start, end in months:
+            catalog.execute('ATTACH DATABASE ? AS part', (os.path.join(directory, name + '.db'),))
+            try:
+                with catalog:
+                    for suffix, width in ROLLUPS:
+                        catalog.execute('DELETE FROM {}_{} WHERE time_ms >= ? AND time_ms < ?'.format(
+                            table, suffix), (start, end))
+                        catalog.execute('INSERT INTO {0}_{1} SELECT sensor, time_ms / {2} * {2}, count(*), {3} '
+                                        'FROM part.{0} GROUP BY sensor, time_ms / {2}'.format(
+                                            table, suffix, width, values))
+            finally:
+                catalog.execute('DETACH DATABASE part')
+
+        return catalog.execute('SELECT count(*) FROM {}_1h'.format(table)).fetchone()[0]
+    finally:
+        catalog.close()
+
+
+def migrate(source, target, sensor=SENSOR, batch=MIGRATE_ROWS):
+    """
+    Copies the airqualitylog and envirosensorlog tables of the
+    database source into the airquality and environment tables
+    of target, which may be the same file, as readings of sensor.
+    Rows are streamed and committed batch at a time so the
+    tables may be any size, then the rollups of each table copied
+    are rebuilt.
+
+    Returns a dict of the rows copied by table.
+    """
+    old = sqlite3.connect(source)
+    copied = {}
+
+    try:
+        present = set(name for name, in old.execute("SELECT name FROM sqlite_master WHERE type = 'table'"))
+
+        for legacy, table, schema, insert, columns in LEGACY_TABLES:
+            if legacy not in present:
+                continue
+
+            rows = 0
+
+            # Open the target first, putting it in WAL mode, so the
+            # copy can read and write the same file.
+            with SQLiteWriter(target, insert, schema, batch, float('inf')) as db:
+                cursor = old.execute('SELECT {} FROM {}'.format(', '.join(columns), legacy))
+
+                while True:
+                    chunk = cursor.fetchmany(batch)
+                    if not chunk:
+                        break
+
+                    for row in chunk:
+                        db.write(record(row, sensor))
+
+                    rows = rows + len(chunk)
+
+                db.flush()
+                rebuild_rollups(db.con, table)
+
+            copied[table] = rows
+
+    finally:
+        old.close()
+
+    return copied
+
+
+def month_of(time_ms):
+    """
+    Returns the UTC (year, month) of time_ms.
+    """
+    t = datetime.fromtimestamp(time_ms / 1000.0, timezone.utc)
+
+    return t.year, t.month
+
+
+def month_range(month):
+    """
+    Returns the start and end of the (year, month) month in
+    milliseconds since the epoch.
+    """
+    year, number = month
+    following = (year + 1, 1) if number == 12 else (year, number + 1)
+
+    return (epoch_ms(datetime(year, number, 1, tzinfo=timezone.utc)),
+            epoch_ms(datetime(following[0], following[1], 1, tzinfo=timezone.utc)))
+
+
+def partition_name(table, month):
+    return '{}-{:04d}-{:02d}'.format(table, month[0], month[1])
+
+
+def catalog_path(directory, table):
+    return os.path.join(directory, table + '.db')
+
+
+def _partitions(catalog, where, *parameters):
+    return [name for name, in catalog.execute(
+        'SELECT name FROM partitions WHERE {} ORDER BY start_ms'.format(where), parameters)]
+
+
+def query(directory, table, start, end, sensor=SENSOR):
+    """
+    As readings(), for the table partitioned in directory by a
+    PartitionedWriter. Yields the rows from each partition the
+    range overlaps in turn, or those of a rollup table from the
+    catalog database.
+    """
+    base = table.split('_')[0]
+    if base not in TABLES:
+        raise ValueError('no table {}'.format(table))
+
+    catalog = sqlite3.connect(catalog_path(directory, base))
+    try:
+        if table != base:
+            for row in readings(catalog, table, start, end, sensor):
+                yield row
+            return
+
+        names = _partitions(catalog, 'end_ms > ? AND start_ms < ?', epoch_ms(start), epoch_ms(end))
+    finally:
+        catalog.close()
+
+    for name in names:
+        part = sqlite3.connect(os.path.join(directory, name + '.db'))
+        try:
+            for row in readings(part, table, start, end, sensor):
+                yield row
+        finally:
+            part.close()
+
+
+def expire(directory, table, days, now=None):
+    """
+    Drops the partitions of table in directory whose month ended
+    more than days days before now (seconds, default the time
+    now), leaving the rollups. Returns the names of those dropped.
+    """
+    if now is None:
+        now = time.time()
+
+    cutoff = epoch_ms(now) - int(days * 86400000)
+
+    catalog = sqlite3.connect(catalog_path(directory, table))
+    try:
+        names = _partitions(catalog, 'end_ms <= ?', cutoff)
+
+        for name in names:
+            # Out of the catalog first, so a query never opens a
+            # partition being deleted.
+            with catalog:
+                catalog.execute('DELETE FROM partitions WHERE name = ?', (name,))
+
+            path = os.path.join(directory, name + '.db')
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+    finally:
+        catalog.close()
+
+    return names
+
+
+def compact(directory, table, now=None):
+    """
+    Rewrites each partition of table in directory that has not
+    been since its month ended, packing its pages and dropping
+    free ones. A copy is made with VACUUM INTO, which only reads
+    the partition, and moved over it, so the writer is never held
+    up. A partition the writer still has open is skipped. Returns
+    the names of the partitions compacted.
+    """
+    if now is None:
+        now = time.time()
+
+    catalog = sqlite3.connect(catalog_path(directory, table))
+    try:
+        compacted = []
+
+        for name in _partitions(catalog, 'compacted = 0 AND end_ms <= ?', epoch_ms(now) - COMPACT_AFTER):
+            path = os.path.join(directory, name + '.db')
+            temp = path + '.tmp'
+
+            if os.path.exists(temp):
+                os.remove(temp)
+
+            part = sqlite3.connect(path)
+            try:
+                # Empty the write ahead log, which would not match
+                # the copy.
+                part.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+                part.execute('VACUUM INTO ?', (temp,))
+            finally:
+                part.close()
+
+            # The log is deleted as the last connection closes, if it
+            # is still there the writer has the partition open (late
+            # readings, or a clock set back) so leave it for now.
+            if os.path.exists(path + '-wal'):
+                os.remove(temp)
+                continue
+
+            os.replace(temp, path)
+
+            with catalog:
+                catalog.execute('UPDATE partitions SET compacted = 1 WHERE name = ?', (name,))
+
+            compacted.append(name)
+    finally:
+        catalog.close()
+
+    return compacted
+
+
+def partition(source, directory, table, batch=MIGRATE_ROWS):
+    """
+    Copies table from the database source into partitions in
+    directory, batch rows at a time. Returns the rows copied.
+    """
+    old = sqlite3.connect(source)
+    rows = 0
+
+    try:
+        with PartitionedWriter(directory, table, batch, float('inf')) as db:
+            cursor = old.execute('SELECT * FROM {}'.format(table))
+
+            while True:
+                chunk = cursor.fetchmany(batch)
+                if not chunk:
+                    break
+
+                for row in chunk:
+                    db.write(row)
+
+                rows = rows + len(chunk)
+    finally:
+        old.close()
+
+    return rows
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Manage the SQLite logs of the dust sensor.')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    command = commands.add_parser('migrate', help='copy the tables of an older database into the current schema')
+    command.add_argument('source', help='database with airqualitylog and or envirosensorlog tables')
+    command.add_argument('target', help='database to copy them into, may be the same file')
+    command.add_argument('--sensor', type=int, default=SENSOR,
+                         help='sensor id of the readings (default %(default)s)')
+    command.add_argument('--batch', type=int, default=MIGRATE_ROWS,
+                         help='rows committed at a time (default %(default)s)')
+
+    command = commands.add_parser('rollup', help='rebuild the rollup tables from the readings')
+    command.add_argument('db', help='database, or directory of partitions, to rebuild the rollups of')
+    command.add_argument('--table', choices=TABLES,
+                         help='only rebuild the rollups of this table')
+
+    command = commands.add_parser('partition', help='copy a table into monthly partitions')
+    command.add_argument('source', help='database holding the table')
+    command.add_argument('directory', help='directory of the partitions')
+    command.add_argument('--table', choices=TABLES, default=TABLES[0],
+                         help='table to copy (default %(default)s)')
+
+    command = commands.add_parser('expire', help='drop the partitions of old months, keeping the rollups')
+    command.add_argument('directory', help='directory of the partitions')
+    command.add_argument('--table', choices=TABLES, default=TABLES[0],
+                         help='partitioned table (default %(default)s)')
+    command.add_argument('--days', type=float, required=True,
+                         help='keep the readings of months that ended in the last DAYS days')
+
+    command = commands.add_parser('compact', help='compact the partitions of months that have ended')
+    command.add_argument('directory', help='directory of the partitions')
+    command.add_argument('--table', choices=TABLES, default=TABLES[0],
+                         help='partitioned table (default %(default)s)')
+
+    args = parser.parse_args()
+
+    if args.command == 'migrate':
+        for table, rows in migrate(args.source, args.target, args.sensor, args.batch).items():
+            print("Copied {} rows into {}".format(rows, table))
+
+    elif args.command == 'rollup' and os.path.isdir(args.db):
+        for table in TABLES:
+            if os.path.exists(catalog_path(args.db, table)) and args.table in (None, table):
+                print("Rebuilt the rollups of {}, {} hours".format(
+                    table, rebuild_partitioned_rollups(args.db, table)))
+
+    elif args.command == 'rollup':
+        con = sqlite3.connect(args.db)
+        present = set(name for name, in con.execute("SELECT name FROM sqlite_master WHERE type = 'table'"))
+
+        for table in TABLES:
+            if table in present and args.table in (None, table):
+                print("Rebuilt the rollups of {}, {} hours".format(table, rebuild_rollups(con, table)))
+
+        con.close()
+
+    elif args.command == 'partition':
+        print("Copied {} rows".format(partition(args.source, args.directory, args.table)))
+
+    elif args.command == 'expire':
+        for name in expire(args.directory, args.table, args.days):
+            print("Dropped {}".format(name))
+
+    elif args.command == 'compact':
+        for name in compact(args.directory, args.table):
+            print("Compacted {}".format(name))